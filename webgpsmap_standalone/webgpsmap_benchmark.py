@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Benchmarks für WebGPSMap Standalone
+Misst, wie die Verarbeitung mit der Größe des Handshakes-Verzeichnisses skaliert.
+Die Ergebnisse werden als JSON ausgegeben, damit Versionen verglichen werden können.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import argparse
+import concurrent.futures
+import multiprocessing
+
+from webgpsmap_standalone import (
+    HandshakeScanner,
+    SerializedPositions,
+    WebGPSMapStandalone,
+    create_app,
+    parse_position_file,
+)
+
+
+def create_scan_fixture(directory, count, subdirs=0):
+    """
+    Legt count Handshakes (leeres .pcap + leere Positionsdatei) an, reihum in allen
+    drei Formaten und jeder zehnte ohne Positionsdatei. Inhalt ist für den Scan egal.
+    """
+    extensions = [".gps.json", ".geo.json", ".paw-gps.json"]
+    targets = [directory]
+    if subdirs:
+        targets = [os.path.join(directory, f"device{i}") for i in range(subdirs)]
+    for target in targets:
+        os.makedirs(target, exist_ok=True)
+    for i in range(count):
+        base = os.path.join(targets[i % len(targets)], f"Net-{i % 997}_{i:012x}")
+        open(base + ".pcap", "wb").close()
+        if i % 10 != 9:
+            open(base + extensions[i % 3], "wb").close()
+
+
+PCAP_HEADER = bytes.fromhex("d4c3b2a1020004000000000000000000ffff000069000000")
+
+
+def create_handshake_fixture(directory, count, seed=1):
+    """
+    Legt ein realistisches Handshakes-Verzeichnis mit count APs an: .pcap mit
+    pcap-Header, Positionsdateien reihum in allen drei Formaten (jeder zehnte AP
+    ohne, einige defekt) und alle drei Potfiles in ihrem jeweiligen Zeilenformat,
+    inklusive APs, die in mehreren Potfiles stehen. Gibt die Anzahl Positionsdateien zurück.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    potfiles = {
+        name: open(os.path.join(directory, name), "w")
+        for name in ("wpa-sec.cracked.potfile", "cracked.pwncrack.potfile", "remote_cracking.potfile")
+    }
+    position_files = 0
+    try:
+        for i in range(count):
+            mac = "%012x" % rng.getrandbits(48)
+            ssid = rng.choice(["FRITZ!Box", "Vodafone", "TP-Link", "o2-WLAN", "Telekom"]) + f"-{i % 4999}"
+            if i % 50 == 0:
+                ssid = ""  # versteckte SSID: Dateiname nur mit MAC
+            base = os.path.join(directory, f"{ssid}_{mac}" if ssid else mac)
+            with open(base + ".pcap", "wb") as f:
+                f.write(PCAP_HEADER + rng.randbytes(rng.randint(200, 600)))
+
+            lat = round(47.3 + rng.random() * 7.7, 7)
+            lng = round(5.9 + rng.random() * 9.1, 7)
+            kind = i % 10
+            if kind == 9:
+                pass  # kein GPS beim Handshake
+            elif i % 997 == 0:
+                with open(base + ".gps.json", "w") as f:
+                    f.write('{"Latitude": ')  # abgebrochen geschrieben
+                position_files += 1
+            elif kind % 3 == 0:
+                with open(base + ".gps.json", "w") as f:
+                    json.dump(
+                        {
+                            "Latitude": lat,
+                            "Longitude": lng,
+                            "Altitude": round(rng.uniform(100, 900), 1),
+                            "Updated": f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}T12:{i % 60:02d}:00.123456+01:00",
+                        },
+                        f,
+                    )
+                position_files += 1
+            elif kind % 3 == 1:
+                with open(base + ".geo.json", "w") as f:
+                    json.dump({"location": {"lat": lat, "lng": lng}, "accuracy": rng.randint(10, 150)}, f)
+                position_files += 1
+            else:
+                with open(base + ".paw-gps.json", "w") as f:
+                    json.dump({"lat": lat, "long": lng, "ts": 1700000000 + i}, f)
+                position_files += 1
+
+            essid = ssid or "hidden"
+            if i % 7 == 0:
+                potfiles["wpa-sec.cracked.potfile"].write(f"{mac}:{rng.getrandbits(48):012x}:{essid}:pw{i}\n")
+            if i % 11 == 0:
+                potfiles["cracked.pwncrack.potfile"].write(
+                    f"{rng.getrandbits(64):016x}:{mac}:{rng.getrandbits(48):012x}:{essid}:pw{i}\n"
+                )
+            if i % 13 == 0:
+                potfiles["remote_cracking.potfile"].write(
+                    f"{rng.getrandbits(64):016x}:{mac}:{rng.getrandbits(48):012x}:{essid}:pw{i}\n"
+                )
+    finally:
+        for f in potfiles.values():
+            f.close()
+    return position_files
+
+
+def legacy_pairing(handshake_dir):
+    """
+    Die frühere Zuordnung aus load_gps_from_dir (os.listdir + Suche in der Liste + os.stat).
+    """
+    all_files = os.listdir(handshake_dir)
+    all_pcap_files = [
+        os.path.join(handshake_dir, filename)
+        for filename in all_files
+        if filename.endswith(".pcap")
+    ]
+    result = []
+    for filename_pcap in all_pcap_files:
+        filename_base = filename_pcap[:-5]
+        for ext in [".gps.json", ".geo.json", ".paw-gps.json"]:
+            check_for = os.path.basename(filename_base) + ext
+            if check_for in all_files:
+                path = os.path.join(handshake_dir, check_for)
+                result.append((path, os.stat(path)))
+                break
+    return result
+
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_scan(sizes, repeat, legacy_limit, subdirs, workdir):
+    results = []
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix=f"webgpsmap-scan-{size}-", dir=workdir)
+        try:
+            start = time.perf_counter()
+            create_scan_fixture(directory, size, subdirs)
+            setup = time.perf_counter() - start
+
+            scanner = HandshakeScanner(recursive=bool(subdirs))
+            paired = len(scanner.scan(directory).position_files)
+            result = {
+                "benchmark": "scan",
+                "files": size,
+                "subdirs": subdirs,
+                "paired": paired,
+                "setup_s": round(setup, 4),
+                "scandir_s": round(best_of(lambda: scanner.scan(directory), repeat), 4),
+                "legacy_s": None,
+            }
+            if not subdirs and size <= legacy_limit:
+                result["legacy_s"] = round(best_of(lambda: legacy_pairing(directory), repeat), 4)
+            results.append(result)
+            print(json.dumps(result), flush=True)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def peak_rss_mb():
+    # ru_maxrss ist unter Linux in KiB, unter macOS in Byte
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def http_latency(client, url, repeat, headers=None):
+    """
+    Erste Anfrage und min/median/max der folgenden in Millisekunden.
+    """
+    times = []
+    status = None
+    size = None
+    for _ in range(repeat + 1):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        size = len(response.get_data())
+        times.append((time.perf_counter() - start) * 1000)
+        status = response.status_code
+    rest = times[1:]
+    return {
+        "status": status,
+        "bytes": size,
+        "first_ms": round(times[0], 2),
+        "min_ms": round(min(rest), 2),
+        "median_ms": round(statistics.median(rest), 2),
+        "max_ms": round(max(rest), 2),
+    }
+
+
+HTTP_ENDPOINTS = [
+    ("index", "/", {"Accept-Encoding": "gzip"}),
+    ("all", "/all", None),
+    ("all_gzip", "/all", {"Accept-Encoding": "gzip"}),
+    ("all_cracked", "/all?status=cracked", None),
+    ("stream_gzip", "/stream", {"Accept-Encoding": "gzip"}),
+    ("search", "/search?ssid=fritz&sort=-ts_last&limit=50", None),
+    ("positions_overview", "/positions", None),
+    ("positions_viewport", "/positions?bbox=9,48,11,50&zoom=12", None),
+    ("positions_window", "/positions?from=2024-03-01&to=2024-03-31&zoom=12", None),
+    ("offlinemap", "/offlinemap", {"Accept-Encoding": "gzip"}),
+    ("heatmap_tile", "/heatmap/8/135/88.png", None),
+]
+
+
+def bench_suite_size(size, repeat, http_repeat, workdir):
+    """
+    Ein kompletter Durchlauf für eine Größe; läuft in einem eigenen Prozess,
+    damit peak_rss_mb nur diese Größe misst.
+    """
+    logging.getLogger().setLevel(logging.CRITICAL)
+    directory = tempfile.mkdtemp(prefix=f"webgpsmap-suite-{size}-", dir=workdir)
+    try:
+        setup, position_files = timed(lambda: create_handshake_fixture(os.path.join(directory, "handshakes"), size))
+        handshakes = os.path.join(directory, "handshakes")
+        index_file = os.path.join(directory, "index.db")
+        result = {
+            "benchmark": "suite",
+            "aps": size,
+            "position_files": position_files,
+            "setup_s": round(setup, 4),
+            "rss_start_mb": peak_rss_mb(),
+        }
+
+        init, webgps = timed(lambda: WebGPSMapStandalone(handshakes, index_file=index_file))
+        result["init_s"] = round(init, 4)
+        result["cracked_keys"] = len(webgps.cracked_passwords)
+        result["cracked_store_mb"] = round(webgps.cracked_passwords.memory_bytes() / 1e6, 3)
+        result["potfile_load_s"] = round(best_of(webgps._load_cracked_passwords, repeat), 4)
+
+        paths = [path for path, _ in webgps.scanner.scan(handshakes).position_files]
+
+        def parse_all():
+            for path in paths:
+                try:
+                    parse_position_file(path)
+                except (ValueError, OSError):
+                    pass
+
+        result["parse_s"] = round(best_of(parse_all, repeat), 4)
+
+        cold, positions = timed(webgps.load_gps_from_dir)
+        result["positions"] = len(positions)
+        result["cold_scan_s"] = round(cold, 4)
+        result["rss_after_cold_scan_mb"] = peak_rss_mb()
+
+        result["warm_scan_s"] = round(best_of(webgps.load_gps_from_dir, repeat), 4)
+
+        # Neustart: neuer Prozesszustand, aber vorhandener Index auf der Platte
+        webgps.index.close()
+        restart, webgps = timed(lambda: WebGPSMapStandalone(handshakes, index_file=index_file))
+        restart_scan, _ = timed(webgps.load_gps_from_dir)
+        result["restart_from_index_s"] = round(restart + restart_scan, 4)
+
+        generation, positions = webgps.current_positions()
+        result["serialize_s"] = round(
+            best_of(lambda: SerializedPositions(positions, generation), repeat), 4
+        )
+
+        client = create_app(webgps).test_client()
+        result["http"] = {
+            name: http_latency(client, url, http_repeat, headers)
+            for name, url, headers in HTTP_ENDPOINTS
+        }
+        result["peak_rss_mb"] = peak_rss_mb()
+        webgps.index.close()
+        return result
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def version_info():
+    info = {"python": platform.python_version(), "platform": platform.platform(), "commit": None}
+    try:
+        info["commit"] = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return info
+
+
+def bench_suite(sizes, repeat, http_repeat, workdir):
+    results = []
+    info = version_info()
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        # frischer Prozess je Größe, sonst wäre peak_rss_mb das Maximum aller Größen
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(bench_suite_size, size, repeat, http_repeat, workdir).result()
+        result.update(info)
+        results.append(result)
+        print(json.dumps(result), flush=True)
+    return results
+
+
+# Schlüssel, die beim Vergleich als Laufzeit bzw. Speicher gelten
+COMPARE_KEYS = (
+    "potfile_load_s",
+    "parse_s",
+    "cold_scan_s",
+    "warm_scan_s",
+    "restart_from_index_s",
+    "serialize_s",
+    "peak_rss_mb",
+)
+
+
+def compare_results(baseline, current, threshold):
+    """
+    Vergleicht zwei Ergebnisdateien der Suite (gleiche Größen) und gibt die
+    Regressionen zurück: Werte, die um mehr als threshold (relativ) schlechter sind.
+    """
+    by_size = {result["aps"]: result for result in baseline if result.get("benchmark") == "suite"}
+    regressions = []
+    for result in current:
+        old = by_size.get(result.get("aps"))
+        if old is None:
+            continue
+        values = [(key, old.get(key), result.get(key)) for key in COMPARE_KEYS]
+        for name, latency in result.get("http", {}).items():
+            old_latency = old.get("http", {}).get(name, {})
+            values.append((f"http.{name}.median_ms", old_latency.get("median_ms"), latency["median_ms"]))
+        for key, before, after in values:
+            if not before or after is None:
+                continue
+            ratio = after / before
+            row = {"aps": result["aps"], "metric": key, "before": before, "after": after, "ratio": round(ratio, 3)}
+            print(json.dumps(row))
+            if ratio > 1 + threshold:
+                regressions.append(row)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks für WebGPSMap Standalone")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    scan = subparsers.add_parser("scan", help="Zuordnung .pcap <-> Positionsdatei")
+    scan.add_argument(
+        "--sizes",
+        default="1000,10000,100000",
+        help="Anzahl Handshakes, kommagetrennt (z. B. 1000,10000,100000,1000000)",
+    )
+    scan.add_argument("--repeat", type=int, default=3, help="Wiederholungen, gemessen wird die beste")
+    scan.add_argument(
+        "--legacy-limit",
+        type=int,
+        default=20000,
+        help="Alte Zuordnung nur bis zu so vielen Dateien messen (quadratische Laufzeit)",
+    )
+    scan.add_argument("--subdirs", type=int, default=0, help="Auf so viele Unterverzeichnisse verteilen")
+    scan.add_argument("--workdir", help="Verzeichnis für die Testdaten (Standard: temp)")
+    scan.add_argument("--output", "-o", help="Ergebnisse zusätzlich als JSON-Datei speichern")
+
+    suite = subparsers.add_parser(
+        "suite", help="Potfiles, Parsen, Kalt-/Warmstart, Serialisierung, HTTP und Speicher"
+    )
+    suite.add_argument(
+        "--sizes",
+        default="1000,10000,100000",
+        help="Anzahl APs, kommagetrennt (z. B. 1000,10000,100000,500000)",
+    )
+    suite.add_argument("--repeat", type=int, default=3, help="Wiederholungen, gemessen wird die beste")
+    suite.add_argument("--http-repeat", type=int, default=20, help="Anfragen je Endpunkt")
+    suite.add_argument("--workdir", help="Verzeichnis für die Testdaten (Standard: temp)")
+    suite.add_argument("--output", "-o", help="Ergebnisse zusätzlich als JSON-Datei speichern")
+
+    compare = subparsers.add_parser("compare", help="Zwei Ergebnisdateien von suite vergleichen")
+    compare.add_argument("baseline", help="Ergebnisse der Vergleichsversion")
+    compare.add_argument("current", help="Ergebnisse der aktuellen Version")
+    compare.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Ab so viel relativer Verschlechterung gilt ein Wert als Regression (Standard: 0.2)",
+    )
+
+    args = parser.parse_args()
+    results = None
+    if args.benchmark == "scan":
+        sizes = [int(size) for size in args.sizes.split(",") if size]
+        results = bench_scan(sizes, args.repeat, args.legacy_limit, args.subdirs, args.workdir)
+    elif args.benchmark == "suite":
+        sizes = [int(size) for size in args.sizes.split(",") if size]
+        results = bench_suite(sizes, args.repeat, args.http_repeat, args.workdir)
+    elif args.benchmark == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} Regression(en) über {args.threshold:.0%}", file=sys.stderr)
+            sys.exit(1)
+        return
+    if args.output and results is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
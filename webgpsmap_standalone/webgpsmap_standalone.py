@@ -13,429 +13,4018 @@ import json
 import re
 import logging
 import datetime
+import math
+import bisect
+import itertools
+import array
+import sqlite3
+import threading
+import queue
+import select
+import struct
+import time
+import ctypes
+import ctypes.util
+import gzip
+import zlib
+import base64
+import hashlib
+import contextlib
+import concurrent.futures
+import multiprocessing
+from collections import OrderedDict
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
 from pathlib import Path
-from flask import Flask, Response, request, jsonify
-from functools import lru_cache
-from dateutil.parser import parse
 import argparse
+import csv
 import sys
 
+# Flask, waitress, brotli und dateutil werden erst bei Bedarf importiert (Webserver,
+# Kompression bzw. Zeitstempel, die kein ISO-8601 sind), damit z. B. --export ohne
+# sie schnell startet.
+numpy = None  # optional, für Heatmap und Fusion der Sichtungen, siehe load_numpy()
+brotli = None  # optional, sonst nur gzip, siehe load_brotli()
+_brotli_checked = False
+
+
+def load_numpy():
+    """
+    Importiert NumPy beim ersten Bedarf; None wenn es nicht installiert ist.
+    """
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            return None
+        numpy = module
+    return numpy
+
+
+def load_brotli():
+    """
+    Importiert brotli beim ersten Bedarf; None wenn es nicht installiert ist.
+    Anders als bei NumPy wird ein fehlgeschlagener Import nicht wiederholt, weil
+    danach bei jeder Antwort gefragt wird.
+    """
+    global brotli, _brotli_checked
+    if not _brotli_checked:
+        try:
+            import brotli as module
+        except ImportError:
+            module = None
+        brotli = module
+        _brotli_checked = True
+    return brotli
+
 # Logging Setup
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
 
+class PositionRecord:
+    """
+    Kompakter Datensatz einer Positionsdatei: nur die Felder, die die Karte braucht,
+    statt des kompletten geparsten JSON.
+    """
+
+    __slots__ = ("ssid", "mac", "type", "lat", "lng", "acc", "ts_first", "ts_last")
+
+    def __init__(self, ssid, mac, type, lat, lng, acc, ts_first, ts_last):
+        self.ssid = ssid
+        self.mac = mac
+        self.type = type
+        self.lat = lat
+        self.lng = lng
+        self.acc = acc
+        self.ts_first = ts_first
+        self.ts_last = ts_last
+
+    def astuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+
+class PositionCache:
+    """
+    Speicherbegrenzter LRU-Cache für PositionRecords. Ein Eintrag gilt nur, solange
+    Größe und mtime der Datei übereinstimmen; neu geschriebene Dateien werden so
+    automatisch neu gelesen.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # path -> (size, mtime_ns, record)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, size, mtime_ns):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == size and entry[1] == mtime_ns:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            return None
+
+    def put(self, path, size, mtime_ns, record):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[path] = (size, mtime_ns, record)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class Quarantine:
+    """
+    Negativ-Cache für defekte Positionsdateien (z. B. halb geschrieben). Wie beim
+    PositionCache gilt ein Eintrag nur, solange Größe und mtime übereinstimmen:
+    bekannte defekte Dateien werden bis zur nächsten Änderung weder geparst noch
+    erneut geloggt. Speicherbegrenzt, verdrängt wird der am längsten nicht mehr
+    gesehene Eintrag.
+    """
+
+    REASONS = ("json", "value", "os")
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # path -> (size, mtime_ns, reason, error, since)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def reason(error):
+        if isinstance(error, json.JSONDecodeError):
+            return "json"
+        if isinstance(error, ValueError):
+            return "value"
+        return "os"
+
+    def get(self, path, size, mtime_ns):
+        """
+        Gibt den Grund zurück, wenn genau diese Version der Datei als defekt bekannt ist.
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == size and entry[1] == mtime_ns:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[2]
+            return None
+
+    def put(self, path, size, mtime_ns, error):
+        """
+        Nimmt eine Datei auf; gibt False zurück, wenn sie mit demselben Fehler schon
+        bekannt war (dann nicht erneut laut melden). size/mtime_ns None: ohne stat-Daten,
+        der Eintrag verhindert dann kein erneutes Parsen.
+        """
+        message = str(error)
+        with self._lock:
+            previous = self._entries.get(path)
+            known = previous is not None and previous[3] == message
+            since = previous[4] if known else time.time()
+            self._entries[path] = (size, mtime_ns, self.reason(error), message, since)
+            self._entries.move_to_end(path)
+            while len(self._entries) > max(self.max_entries, 0):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return not known
+
+    def discard(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def retain(self, directory, existing):
+        """
+        Entfernt Einträge unterhalb von directory, deren Datei es nicht mehr gibt.
+        """
+        prefix = os.path.join(directory, "")
+        with self._lock:
+            gone = [path for path in self._entries if path.startswith(prefix) and path not in existing]
+            for path in gone:
+                del self._entries[path]
+        return len(gone)
+
+    def report(self):
+        """
+        Liste der defekten Dateien mit Grund, sortiert nach Pfad.
+        """
+        with self._lock:
+            entries = list(self._entries.items())
+        return [
+            {"path": path, "reason": reason, "error": error, "size": size, "since": int(since)}
+            for path, (size, _, reason, error, since) in sorted(entries)
+        ]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return path in self._entries
+
+
+class PositionIndex:
+    """
+    Persistenter Positions-Index auf Basis von SQLite.
+    Schlüssel ist der Pfad der Positionsdatei, gültig ist ein Eintrag nur solange
+    Größe und mtime der Datei übereinstimmen. Dadurch müssen nach einem Neustart
+    nur neue oder geänderte Dateien geparst werden.
+    """
+
+    SCHEMA_VERSION = 2  # 2: ts_first/ts_last immer ganze Unix-Sekunden
+    FIELDS = PositionRecord.__slots__
+    LOOKUP_BATCH = 500  # Pfade pro Abfrage, unter der Variablengrenze älterer SQLite-Versionen
+
+    def __init__(self, db_path=":memory:"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        if db_path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'schema_version'"
+            ).fetchone()
+            if row is None or int(row[0]) != self.SCHEMA_VERSION:
+                # Altes oder unbekanntes Schema: Index verwerfen und neu aufbauen
+                self._conn.execute("DROP TABLE IF EXISTS positions")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)",
+                    (str(self.SCHEMA_VERSION),),
+                )
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS positions (
+                    path TEXT PRIMARY KEY,
+                    dir TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    ssid TEXT,
+                    mac TEXT,
+                    type INTEGER,
+                    lat REAL,
+                    lng REAL,
+                    acc REAL,
+                    ts_first INTEGER,
+                    ts_last INTEGER
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS positions_dir ON positions (dir)"
+            )
+
+    def entries(self, directory):
+        """
+        Gibt alle Einträge eines Verzeichnisses zurück: { path: (size, mtime_ns, PositionRecord) }
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, size, mtime_ns, " + ", ".join(self.FIELDS)
+                + " FROM positions WHERE dir = ?",
+                (directory,),
+            ).fetchall()
+        return {row[0]: (row[1], row[2], PositionRecord(*row[3:])) for row in rows}
+
+    def lookup(self, paths):
+        """
+        Wie entries(), aber nur für die angegebenen Pfade (blockweises Lesen).
+        """
+        paths = list(paths)
+        result = {}
+        for start in range(0, len(paths), self.LOOKUP_BATCH):
+            batch = paths[start : start + self.LOOKUP_BATCH]
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT path, size, mtime_ns, " + ", ".join(self.FIELDS)
+                    + " FROM positions WHERE path IN (" + ", ".join("?" * len(batch)) + ")",
+                    batch,
+                ).fetchall()
+            result.update((row[0], (row[1], row[2], PositionRecord(*row[3:]))) for row in rows)
+        return result
+
+    def update(self, directory, upserts, removed):
+        """
+        Schreibt geänderte Einträge und entfernt verschwundene Dateien in einer Transaktion.
+        upserts: [(path, size, mtime_ns, PositionRecord), ...]
+        removed: [path, ...]
+        """
+        if not upserts and not removed:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO positions (path, dir, size, mtime_ns, "
+                + ", ".join(self.FIELDS)
+                + ") VALUES (?, ?, ?, ?"
+                + ", ?" * len(self.FIELDS)
+                + ")",
+                [
+                    (path, directory, size, mtime_ns) + record.astuple()
+                    for path, size, mtime_ns, record in upserts
+                ],
+            )
+            self._conn.executemany(
+                "DELETE FROM positions WHERE path = ?", [(path,) for path in removed]
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class EventBroker:
+    """
+    Verteilt Live-Updates an verbundene Browser (Server-Sent Events).
+    Jeder Client bekommt eine eigene Queue; läuft sie voll, wird sie geleert
+    und der Client per "reload" aufgefordert, die Daten neu zu laden.
+    """
+
+    def __init__(self, max_queue=100):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._max_queue = max_queue
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self._max_queue)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event, payload):
+        data = json.dumps(payload)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                # Langsamer Client: Deltas verwerfen, vollständiges Neuladen anstoßen
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(("reload", "{}"))
+
+    def stream(self, keepalive=15.0):
+        """
+        Generator für eine text/event-stream Antwort.
+        """
+        subscriber = self.subscribe()
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {data}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+
+class DirectoryWatcher:
+    """
+    Beobachtet ein Verzeichnis auf neue, geänderte und gelöschte Dateien.
+    Unter Linux über inotify (ctypes), sonst per Polling. Änderungen werden kurz
+    gesammelt und gebündelt als Menge von Dateinamen (relativ zum Verzeichnis)
+    an den Callback übergeben; None bedeutet, dass Ereignisse verloren gingen
+    oder sich Unterverzeichnisse geändert haben und alles geprüft werden muss.
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self, path, callback, debounce=1.0, poll_interval=5.0, recursive=False):
+        self.path = path
+        self.callback = callback
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.recursive = recursive
+        self._stop = threading.Event()
+        self._thread = None
+        self._fd = None
+        self._libc = None
+        self._watches = {}  # watch descriptor -> Unterverzeichnis (relativ)
+        self._previous = {}
+
+    def start(self):
+        self._fd = self._init_inotify()
+        if self._fd is not None:
+            logging.info(f"[webgpsmap] Beobachte {self.path} (inotify)")
+            target = self._run_inotify
+        else:
+            logging.info(
+                f"[webgpsmap] Beobachte {self.path} (Polling alle {self.poll_interval}s)"
+            )
+            target = self._run_polling
+            self._previous = self._snapshot()
+        self._thread = threading.Thread(target=target, name="webgpsmap-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _init_inotify(self):
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1")
+            self._libc = libc
+            try:
+                self._add_watches(fd, "")
+            except OSError:
+                os.close(fd)
+                raise
+            return fd
+        except (OSError, AttributeError) as error:
+            logging.warning(f"[webgpsmap] inotify nicht verfügbar, nutze Polling: {error}")
+            return None
+
+    def _add_watches(self, fd, relative):
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_DELETE
+        if self.recursive:
+            mask |= self.IN_CREATE  # für neue Unterverzeichnisse
+        wd = self._libc.inotify_add_watch(fd, os.fsencode(os.path.join(self.path, relative)), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch")
+        self._watches[wd] = relative
+        if self.recursive:
+            with os.scandir(os.path.join(self.path, relative)) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        self._add_watches(fd, os.path.join(relative, entry.name))
+
+    def _read_events(self):
+        names = set()
+        try:
+            buf = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return names
+        offset = 0
+        rescan = False
+        while offset < len(buf):
+            wd, mask, _, length = self.EVENT_HEADER.unpack_from(buf, offset)
+            offset += self.EVENT_HEADER.size
+            name = buf[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                rescan = True
+                continue
+            if not name or wd not in self._watches:
+                continue
+            relative = os.path.join(self._watches[wd], os.fsdecode(name))
+            if mask & self.IN_ISDIR:
+                if not self.recursive:
+                    continue
+                # Neues oder verschobenes Unterverzeichnis: beobachten und alles prüfen
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    try:
+                        self._add_watches(self._fd, relative)
+                    except OSError as error:
+                        logging.error(f"[webgpsmap] Kann {relative} nicht beobachten: {error}")
+                rescan = True
+                continue
+            if mask & self.IN_CREATE:
+                continue  # Datei wird noch geschrieben, IN_CLOSE_WRITE folgt
+            names.add(relative)
+        return None if rescan else names
+
+    def _run_inotify(self):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._fd], [], [], 1.0)
+            if not ready:
+                continue
+            names = self._read_events()
+            # Schreibvorgänge von pwnagotchi (pcap + json) zusammenfassen
+            deadline = time.monotonic() + self.debounce
+            while (remaining := deadline - time.monotonic()) > 0:
+                ready, _, _ = select.select([self._fd], [], [], remaining)
+                if ready:
+                    more = self._read_events()
+                    names = None if names is None or more is None else names | more
+            if names is None or names:
+                self._dispatch(names)
+
+    def _snapshot(self):
+        result = {}
+        pending = [""]
+        while pending:
+            relative = pending.pop()
+            with os.scandir(os.path.join(self.path, relative)) as entries:
+                for entry in entries:
+                    name = os.path.join(relative, entry.name)
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.recursive:
+                                pending.append(name)
+                            continue
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    result[name] = (stat.st_size, stat.st_mtime_ns)
+        return result
+
+    def _run_polling(self):
+        previous = self._previous
+        while not self._stop.wait(self.poll_interval):
+            try:
+                current = self._snapshot()
+            except OSError as error:
+                logging.error(f"[webgpsmap] Fehler beim Polling von {self.path}: {error}")
+                continue
+            changed = {
+                name for name, value in current.items() if previous.get(name) != value
+            }
+            changed.update(name for name in previous if name not in current)
+            previous = current
+            if changed:
+                self._dispatch(changed)
+
+    def _dispatch(self, names):
+        try:
+            self.callback(names)
+        except Exception as error:
+            logging.error(f"[webgpsmap] Fehler bei der Verarbeitung von Dateiänderungen: {error}")
+
+
+class SightingStore:
+    """
+    Sichtungen eines APs (Position mit Genauigkeit und Zeitraum) in Spalten-Arrays,
+    jede einer Gruppe (Schlüssel im Ergebnis) zugeordnet. fuse() berechnet je Gruppe
+    den nach Genauigkeit gewichteten Schwerpunkt (Gewicht 1/acc²), die Streuung um
+    ihn (gewichteter RMS-Abstand in Metern), die kombinierte Genauigkeit und den
+    Zeitraum über alle Sichtungen. Bereits fusionierte Einträge lassen sich erneut
+    fusionieren (z. B. über mehrere Geräte), das Ergebnis ist dasselbe wie über alle
+    Einzelsichtungen. Mit NumPy für alle Gruppen auf einmal, sonst in Python.
+    """
+
+    DEFAULT_ACCURACY = 50.0  # Meter, für Sichtungen ohne Angabe
+    MIN_ACCURACY = 1.0  # kleinere Angaben einer Sichtung würden sie allein bestimmen lassen
+    EARTH_RADIUS = 6371008.8
+    MIN_VECTORIZED = 64  # darunter lohnt sich NumPy nicht
+
+    def __init__(self):
+        self.groups = []  # Schlüssel je Gruppe, in Reihenfolge des ersten add()
+        self._group_ids = dict()
+        self._group = array.array("q")
+        self._lat = array.array("d")
+        self._lng = array.array("d")
+        self._acc = array.array("d")  # NaN: ohne Angabe
+        self._spread = array.array("d")
+        self._ts_first = array.array("d")  # NaN: unbekannt
+        self._ts_last = array.array("d")
+        self._count = array.array("q")
+
+    @staticmethod
+    def _number(value):
+        return math.nan if value is None else float(value)
+
+    def add(self, key, ap_data):
+        group = self._group_ids.get(key)
+        if group is None:
+            group = self._group_ids[key] = len(self.groups)
+            self.groups.append(key)
+        self._group.append(group)
+        self._lat.append(float(ap_data["lat"]))
+        self._lng.append(float(ap_data["lng"]))
+        self._acc.append(self._number(ap_data["acc"]))
+        self._spread.append(ap_data.get("spread") or 0.0)
+        self._ts_first.append(self._number(ap_data["ts_first"]))
+        self._ts_last.append(self._number(ap_data["ts_last"]))
+        self._count.append(ap_data.get("sightings") or 1)
+
+    def __len__(self):
+        return len(self._group)
+
+    def fuse(self):
+        """
+        Gibt je Gruppe (in Reihenfolge von groups) die fusionierten Felder lat, lng,
+        acc, spread, ts_first, ts_last und sightings als dict zurück.
+        """
+        np = load_numpy() if len(self) >= self.MIN_VECTORIZED else None
+        columns = self._fuse_numpy(np) if np is not None else self._fuse_python()
+        fields = ("lat", "lng", "acc", "spread", "ts_first", "ts_last", "sightings")
+        return [
+            {
+                field: (None if isinstance(value, float) and math.isnan(value) else value)
+                for field, value in zip(fields, row)
+            }
+            for row in zip(*columns)
+        ]
+
+    def _fuse_numpy(self, np):
+        groups = len(self.groups)
+        group = np.frombuffer(self._group, dtype=np.int64)
+        lat = np.frombuffer(self._lat, dtype=np.float64)
+        lng = np.frombuffer(self._lng, dtype=np.float64)
+        acc = np.frombuffer(self._acc, dtype=np.float64)
+        spread = np.frombuffer(self._spread, dtype=np.float64)
+        count = np.frombuffer(self._count, dtype=np.int64)
+        known = ~np.isnan(acc)
+
+        # Fusionierte Einträge zählen mit dem Gewicht aller ihrer Sichtungen
+        floor = self.MIN_ACCURACY / np.sqrt(count)
+        weight = np.where(
+            known,
+            1.0 / np.square(np.maximum(np.where(known, acc, 1.0), floor)),
+            count / self.DEFAULT_ACCURACY**2,
+        )
+        total = np.bincount(group, weight, groups)
+        center_lat = np.bincount(group, weight * lat, groups) / total
+        center_lng = np.bincount(group, weight * lng, groups) / total
+        # Abstand zum Schwerpunkt in Metern (lokal eben, genügt für Sichtungen eines APs)
+        dlat = np.radians(lat - center_lat[group])
+        dlng = np.radians(lng - center_lng[group]) * np.cos(np.radians(center_lat[group]))
+        distance2 = (np.square(dlat) + np.square(dlng)) * self.EARTH_RADIUS**2
+        fused_spread = np.sqrt(np.bincount(group, weight * (np.square(spread) + distance2), groups) / total)
+        fused_acc = np.where(np.bincount(group, known, groups) > 0, 1.0 / np.sqrt(total), np.nan)
+
+        # fmin/fmax übergehen NaN, Gruppen ganz ohne Zeitstempel bleiben bei ±inf
+        ts_first = np.full(groups, np.inf)
+        np.fmin.at(ts_first, group, np.frombuffer(self._ts_first, dtype=np.float64))
+        ts_last = np.full(groups, -np.inf)
+        np.fmax.at(ts_last, group, np.frombuffer(self._ts_last, dtype=np.float64))
+        sightings = np.bincount(group, count, groups).astype(np.int64)
+        return (
+            center_lat.tolist(),
+            center_lng.tolist(),
+            fused_acc.tolist(),
+            fused_spread.tolist(),
+            [int(ts) if math.isfinite(ts) else None for ts in ts_first.tolist()],
+            [int(ts) if math.isfinite(ts) else None for ts in ts_last.tolist()],
+            sightings.tolist(),
+        )
+
+    def _fuse_python(self):
+        groups = len(self.groups)
+        total = [0.0] * groups
+        sum_lat = [0.0] * groups
+        sum_lng = [0.0] * groups
+        known = [False] * groups
+        ts_first = [None] * groups
+        ts_last = [None] * groups
+        sightings = [0] * groups
+        weights = []
+        for i, group in enumerate(self._group):
+            acc, count = self._acc[i], self._count[i]
+            if math.isnan(acc):
+                weight = count / self.DEFAULT_ACCURACY**2
+            else:
+                weight = 1.0 / max(acc, self.MIN_ACCURACY / math.sqrt(count)) ** 2
+            weights.append(weight)
+            total[group] += weight
+            sum_lat[group] += weight * self._lat[i]
+            sum_lng[group] += weight * self._lng[i]
+            known[group] = known[group] or not math.isnan(acc)
+            first, last = self._ts_first[i], self._ts_last[i]
+            if not math.isnan(first) and (ts_first[group] is None or first < ts_first[group]):
+                ts_first[group] = first
+            if not math.isnan(last) and (ts_last[group] is None or last > ts_last[group]):
+                ts_last[group] = last
+            sightings[group] += count
+        center_lat = [sum_lat[g] / total[g] for g in range(groups)]
+        center_lng = [sum_lng[g] / total[g] for g in range(groups)]
+        sum_spread = [0.0] * groups
+        for i, group in enumerate(self._group):
+            dlat = math.radians(self._lat[i] - center_lat[group])
+            dlng = math.radians(self._lng[i] - center_lng[group]) * math.cos(math.radians(center_lat[group]))
+            distance2 = (dlat * dlat + dlng * dlng) * self.EARTH_RADIUS**2
+            sum_spread[group] += weights[i] * (self._spread[i] ** 2 + distance2)
+        return (
+            center_lat,
+            center_lng,
+            [1.0 / math.sqrt(total[g]) if known[g] else None for g in range(groups)],
+            [math.sqrt(sum_spread[g] / total[g]) for g in range(groups)],
+            [None if ts is None else int(ts) for ts in ts_first],
+            [None if ts is None else int(ts) for ts in ts_last],
+            sightings,
+        )
+
+
+class SpatialIndex:
+    """
+    Raster-Index über die AP-Positionen für Kartenausschnitt-Abfragen mit
+    zoomabhängigem Clustering. Die Zellen folgen den Web-Mercator-Kacheln
+    (CELLS_PER_TILE² Zellen pro 256px-Kachel) und werden pro Zoomstufe erst
+    bei Bedarf aufgebaut.
+    """
+
+    CELLS_PER_TILE = 4  # Cluster-Zelle = 64px
+    MAX_CLUSTER_ZOOM = 16  # darüber werden immer einzelne Punkte geliefert
+    POINT_LIMIT = 500  # so wenige APs im Ausschnitt werden nicht geclustert
+    MAX_LAT = 85.05112878
+
+    def __init__(self, positions, generation):
+        self.positions = positions
+        self.generation = generation
+        self._coords = {}
+        self._grids = {}
+        self._lock = threading.Lock()
+        self.bounds = None
+
+        min_lat = min_lng = float("inf")
+        max_lat = max_lng = float("-inf")
+        for key, ap_data in positions.items():
+            try:
+                lat, lng = float(ap_data["lat"]), float(ap_data["lng"])
+            except (TypeError, ValueError):
+                continue
+            self._coords[key] = (lat, lng, self._mercator_x(lng), self._mercator_y(lat))
+            min_lat, max_lat = min(min_lat, lat), max(max_lat, lat)
+            min_lng, max_lng = min(min_lng, lng), max(max_lng, lng)
+        if self._coords:
+            self.bounds = [[min_lat, min_lng], [max_lat, max_lng]]
+
+    @staticmethod
+    def _mercator_x(lng):
+        return (min(max(lng, -180.0), 180.0) + 180.0) / 360.0
+
+    @classmethod
+    def _mercator_y(cls, lat):
+        lat = math.radians(min(max(lat, -cls.MAX_LAT), cls.MAX_LAT))
+        return (1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0
+
+    def _cells(self, zoom):
+        return (1 << zoom) * self.CELLS_PER_TILE
+
+    def _grid(self, zoom):
+        """
+        Zellen einer Zoomstufe: {(cx, cy): [count, cracked, sum_lat, sum_lng, keys]}
+        """
+        with self._lock:
+            grid = self._grids.get(zoom)
+            if grid is not None:
+                return grid
+            grid = {}
+            cells = self._cells(zoom)
+            for key, (lat, lng, x, y) in self._coords.items():
+                cell_key = (min(int(x * cells), cells - 1), min(int(y * cells), cells - 1))
+                cell = grid.get(cell_key)
+                if cell is None:
+                    cell = grid[cell_key] = [0, 0, 0.0, 0.0, []]
+                cell[0] += 1
+                if self.positions[key]["pass"]:
+                    cell[1] += 1
+                cell[2] += lat
+                cell[3] += lng
+                cell[4].append(key)
+            self._grids[zoom] = grid
+            return grid
+
+    def query(self, bbox=None, zoom=0, keys=None):
+        """
+        Liefert die APs bzw. Cluster im Ausschnitt.
+        bbox: (west, south, east, north) in Grad oder None für alles
+        keys: optional Menge der Schlüssel, die den Filtern entsprechen
+        """
+        zoom = min(max(int(zoom), 0), 22)
+        cluster = zoom <= self.MAX_CLUSTER_ZOOM
+        grid_zoom = min(zoom, self.MAX_CLUSTER_ZOOM)
+        grid = self._grid(grid_zoom)
+        cells = self._cells(grid_zoom)
+
+        if bbox is None:
+            west, south, east, north = -180.0, -90.0, 180.0, 90.0
+        else:
+            west, south, east, north = bbox
+        x0 = min(int(self._mercator_x(west) * cells), cells - 1)
+        x1 = min(int(self._mercator_x(east) * cells), cells - 1)
+        y0 = min(int(self._mercator_y(north) * cells), cells - 1)
+        y1 = min(int(self._mercator_y(south) * cells), cells - 1)
+
+        # Entweder die Zellen des Ausschnitts oder alle belegten Zellen durchgehen, was weniger ist
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(grid):
+            visible = [
+                grid[(cx, cy)]
+                for cx in range(x0, x1 + 1)
+                for cy in range(y0, y1 + 1)
+                if (cx, cy) in grid
+            ]
+        else:
+            visible = [
+                cell
+                for (cx, cy), cell in grid.items()
+                if x0 <= cx <= x1 and y0 <= cy <= y1
+            ]
+
+        if keys is not None:
+            # Gefilterte Abfrage: nur die Zellen im Ausschnitt neu zusammenfassen. Wenige
+            # Treffer (z. B. ein kurzer Zeitraum) direkt einsortieren statt die Zellen zu durchsuchen
+            if len(keys) < sum(cell[0] for cell in visible):
+                groups = {}
+                for key in keys:
+                    coord = self._coords.get(key)
+                    if coord is None:
+                        continue
+                    cx, cy = min(int(coord[2] * cells), cells - 1), min(int(coord[3] * cells), cells - 1)
+                    if x0 <= cx <= x1 and y0 <= cy <= y1:
+                        groups.setdefault((cx, cy), []).append(key)
+                key_lists = groups.values()
+            else:
+                key_lists = ([key for key in cell[4] if key in keys] for cell in visible)
+            filtered = []
+            for cell_keys in key_lists:
+                if not cell_keys:
+                    continue
+                coords = [self._coords[key] for key in cell_keys]
+                filtered.append(
+                    [
+                        len(cell_keys),
+                        sum(1 for key in cell_keys if self.positions[key]["pass"]),
+                        sum(coord[0] for coord in coords),
+                        sum(coord[1] for coord in coords),
+                        cell_keys,
+                    ]
+                )
+            visible = filtered
+
+        def in_bbox(key):
+            lat, lng = self._coords[key][:2]
+            return south <= lat <= north and west <= lng <= east
+
+        in_view = sum(cell[0] for cell in visible)
+        clusters = []
+        points = []
+        if not cluster or in_view <= self.POINT_LIMIT:
+            points = [self.positions[key] for cell in visible for key in cell[4] if in_bbox(key)]
+            in_view = len(points)
+        else:
+            for count, cracked, sum_lat, sum_lng, cell_keys in visible:
+                if count == 1:
+                    if in_bbox(cell_keys[0]):
+                        points.append(self.positions[cell_keys[0]])
+                    continue
+                clusters.append(
+                    {
+                        "lat": sum_lat / count,
+                        "lng": sum_lng / count,
+                        "count": count,
+                        "cracked": cracked,
+                    }
+                )
+
+        return {
+            "generation": self.generation,
+            "zoom": zoom,
+            "total": len(self._coords) if keys is None else len(keys),
+            "in_view": in_view,
+            "bounds": self.bounds,
+            "clusters": clusters,
+            "points": points,
+        }
+
+
+class HeatmapIndex:
+    """
+    Dichte-Raster als PNG-Kacheln (Kanal "all" oder "cracked"), mit NumPy berechnet.
+    Pro Zoomstufe werden die Punkte einmal nach ihrer Rasterzelle sortiert; eine
+    Kachel ist dann ein searchsorted-Ausschnitt plus bincount. Gerenderte Kacheln
+    liegen in einem LRU-Cache; der ganze Index gilt für eine Generation des Bestands.
+    """
+
+    CHANNELS = ("all", "cracked")
+    TILE_SIZE = 256
+    BINS = 32  # Zellen pro Kachelkante, eine Zelle = 8px
+    MAX_ZOOM = 16  # darüber skaliert Leaflet die Kacheln dieser Stufe
+    ZOOM_CACHE = 6  # so viele Zoomstufen bleiben sortiert im Speicher
+    TILE_CACHE = 1024
+    GRADIENTS = {
+        "all": ((0, 0, 255), (0, 255, 255), (0, 255, 0), (255, 255, 0), (255, 0, 0)),
+        "cracked": ((0, 96, 0), (0, 192, 0), (128, 255, 0), (255, 255, 0)),
+    }
+
+    def __init__(self, positions, generation):
+        if load_numpy() is None:
+            raise ValueError("Heatmap benötigt NumPy (pip3 install numpy)")
+        self.generation = generation
+        lat = numpy.full(len(positions), numpy.nan)
+        lng = numpy.full(len(positions), numpy.nan)
+        cracked = numpy.zeros(len(positions), dtype=bool)
+        for i, ap_data in enumerate(positions.values()):
+            try:
+                lat[i], lng[i] = float(ap_data["lat"]), float(ap_data["lng"])
+            except (TypeError, ValueError):
+                continue
+            cracked[i] = bool(ap_data["pass"])
+        valid = ~(numpy.isnan(lat) | numpy.isnan(lng))
+        lat, lng, self._cracked = lat[valid], lng[valid], cracked[valid]
+        # Web-Mercator in [0, 1), wie SpatialIndex
+        self._x = (numpy.clip(lng, -180.0, 180.0) + 180.0) / 360.0
+        lat = numpy.radians(numpy.clip(lat, -SpatialIndex.MAX_LAT, SpatialIndex.MAX_LAT))
+        self._y = (1.0 - numpy.log(numpy.tan(lat) + 1.0 / numpy.cos(lat)) / numpy.pi) / 2.0
+        self._zooms = OrderedDict()
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+        self._palettes = {channel: self._palette(colors) for channel, colors in self.GRADIENTS.items()}
+        self.empty_tile = self._png(numpy.zeros((self.TILE_SIZE, self.TILE_SIZE, 4), dtype=numpy.uint8))
+
+    @staticmethod
+    def _palette(colors):
+        """
+        Farbverlauf mit 256 Stufen (RGBA); Stufe 0 bleibt durchsichtig.
+        """
+        stops = numpy.linspace(0.0, 1.0, len(colors))
+        levels = numpy.linspace(0.0, 1.0, 256)
+        palette = numpy.empty((256, 4), dtype=numpy.uint8)
+        for channel in range(3):
+            palette[:, channel] = numpy.interp(levels, stops, [color[channel] for color in colors])
+        palette[:, 3] = numpy.interp(levels, (0.0, 0.3, 1.0), (96, 176, 224))
+        palette[0] = 0
+        return palette
+
+    @staticmethod
+    def _png(rgba):
+        """
+        Kodiert ein (höhe, breite, 4)-Array als PNG (Filter 0, zlib), ohne Pillow.
+        """
+        height, width, _ = rgba.shape
+        rows = numpy.zeros((height, width * 4 + 1), dtype=numpy.uint8)
+        rows[:, 1:] = rgba.reshape(height, width * 4)
+
+        def chunk(tag, data):
+            return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+        return (
+            b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows.tobytes(), 6))
+            + chunk(b"IEND", b"")
+        )
+
+    def _zoom(self, zoom):
+        """
+        Sortierte Zellnummern der Punkte einer Zoomstufe und das Maximum je Kanal
+        (für eine über alle Kacheln einheitliche Farbskala).
+        """
+        with self._lock:
+            cached = self._zooms.get(zoom)
+            if cached is not None:
+                self._zooms.move_to_end(zoom)
+                return cached
+        cells = (1 << zoom) * self.BINS
+        cx = numpy.minimum((self._x * cells).astype(numpy.int64), cells - 1)
+        cy = numpy.minimum((self._y * cells).astype(numpy.int64), cells - 1)
+        # Zellnummer kachelweise: (kachel, zeile, spalte), damit eine Kachel ein zusammenhängender Bereich ist
+        tiles = (cx // self.BINS) * (1 << zoom) + cy // self.BINS
+        bins = (tiles * self.BINS + cy % self.BINS) * self.BINS + cx % self.BINS
+        order = numpy.argsort(bins, kind="stable")
+        bins = bins[order]
+        cracked = self._cracked[order]
+        maxima = {
+            "all": self._max_count(bins),
+            "cracked": self._max_count(bins[cracked]),
+        }
+        cached = (bins, cracked, maxima)
+        with self._lock:
+            self._zooms[zoom] = cached
+            while len(self._zooms) > self.ZOOM_CACHE:
+                self._zooms.popitem(last=False)
+        return cached
+
+    @staticmethod
+    def _max_count(sorted_bins):
+        if not len(sorted_bins):
+            return 0
+        boundaries = numpy.flatnonzero(numpy.diff(sorted_bins)) + 1
+        return int(numpy.diff(numpy.concatenate(([0], boundaries, [len(sorted_bins)]))).max())
+
+    def tile(self, zoom, x, y, channel="all"):
+        """
+        Gibt (png, etag) für eine Kachel zurück, None außerhalb der Karte.
+        """
+        if channel not in self.CHANNELS:
+            raise ValueError(f"Ungültiger Kanal: {channel} (erlaubt: {', '.join(self.CHANNELS)})")
+        if not 0 <= zoom <= self.MAX_ZOOM or not (0 <= x < (1 << zoom) and 0 <= y < (1 << zoom)):
+            return None
+        cache_key = (zoom, x, y, channel)
+        with self._lock:
+            cached = self._tiles.get(cache_key)
+            if cached is not None:
+                self._tiles.move_to_end(cache_key)
+                return cached
+
+        bins, cracked, maxima = self._zoom(zoom)
+        cells_per_tile = self.BINS * self.BINS
+        first = (x * (1 << zoom) + y) * cells_per_tile
+        start, end = numpy.searchsorted(bins, (first, first + cells_per_tile))
+        local = bins[start:end] - first
+        if channel == "cracked":
+            local = local[cracked[start:end]]
+        if not len(local):
+            png = self.empty_tile
+        else:
+            counts = numpy.bincount(local, minlength=cells_per_tile).reshape(self.BINS, self.BINS)
+            # logarithmisch, sonst verschwinden dünn besetzte Gegenden neben Hotspots
+            levels = numpy.log1p(counts) / math.log1p(max(maxima[channel], 1)) * 255
+            levels = numpy.where(counts > 0, numpy.maximum(levels, 1), 0).astype(numpy.uint8)
+            scale = self.TILE_SIZE // self.BINS
+            image = self._palettes[channel][levels].repeat(scale, axis=0).repeat(scale, axis=1)
+            png = self._png(image)
+        cached = (png, hashlib.sha1(png).hexdigest())
+        with self._lock:
+            self._tiles[cache_key] = cached
+            while len(self._tiles) > self.TILE_CACHE:
+                self._tiles.popitem(last=False)
+        return cached
+
+
+class FilterIndex:
+    """
+    Vorberechnete Nachschlage-Strukturen für serverseitiges Filtern, Sortieren
+    und Blättern: Menge der geknackten APs, Index pro Passwort-Quelle, ein
+    Index über die kleingeschriebenen SSIDs für Teilstring- und Präfixsuche und
+    ein nach Zeitstempel sortierter Index für Zeiträume (from/to).
+    """
+
+    STATUS = ("all", "cracked", "uncracked")
+    SSID_MATCH = ("substring", "prefix")
+    SORT_FIELDS = ("ssid", "mac", "type", "acc", "ts_first", "ts_last")
+    TIME_FIELDS = ("ts_last", "ts_first")
+    MAX_LIMIT = 10000
+
+    def __init__(self, positions, generation):
+        self.positions = positions
+        self.generation = generation
+        self.cracked = set()
+        self.by_source = {}
+        self._by_ssid = {}
+        self._sorted = {}
+        self._timelines = {}
+        self._lock = threading.Lock()
+
+        for key, ap_data in positions.items():
+            if ap_data["pass"]:
+                self.cracked.add(key)
+            sources = ap_data["sources"] or ([ap_data["pass_source"]] if ap_data["pass_source"] else [])
+            for source in sources:
+                self.by_source.setdefault(source, set()).add(key)
+            self._by_ssid.setdefault(ap_data["ssid"].lower(), []).append(key)
+        # Eindeutige SSIDs sortiert: Präfixsuche per Binärsuche, Teilstringsuche nur über eindeutige Namen
+        self._ssids = sorted(self._by_ssid)
+
+    @classmethod
+    def parse_args(cls, args):
+        """
+        Liest die Filter-Parameter aus den Query-Argumenten; wirft ValueError bei ungültigen Werten.
+        """
+        params = {
+            "status": args.get("status", "all"),
+            "ssid": args.get("ssid", "").strip().lower(),
+            "ssid_match": args.get("ssid_match", "substring"),
+            "source": args.get("source", "all"),
+            "sort": args.get("sort", ""),
+            "limit": args.get("limit", ""),
+            "offset": args.get("offset", "0"),
+            "time": args.get("time", "ts_last"),
+            "from": cls._parse_time(args.get("from", "")),
+            "to": cls._parse_time(args.get("to", ""), end=True),
+        }
+        if params["status"] not in cls.STATUS:
+            raise ValueError(f"status muss einer von {', '.join(cls.STATUS)} sein")
+        if params["ssid_match"] not in cls.SSID_MATCH:
+            raise ValueError(f"ssid_match muss einer von {', '.join(cls.SSID_MATCH)} sein")
+        if params["sort"] and params["sort"].lstrip("-") not in cls.SORT_FIELDS:
+            raise ValueError(f"sort muss einer von {', '.join(cls.SORT_FIELDS)} sein (absteigend mit -)")
+        try:
+            params["limit"] = min(int(params["limit"]), cls.MAX_LIMIT) if params["limit"] else None
+            params["offset"] = int(params["offset"])
+        except ValueError:
+            raise ValueError("limit und offset müssen Zahlen sein")
+        if (params["limit"] is not None and params["limit"] < 0) or params["offset"] < 0:
+            raise ValueError("limit und offset dürfen nicht negativ sein")
+        if params["time"] not in cls.TIME_FIELDS:
+            raise ValueError(f"time muss einer von {', '.join(cls.TIME_FIELDS)} sein")
+        if params["from"] is not None and params["to"] is not None and params["from"] > params["to"]:
+            raise ValueError("from darf nicht nach to liegen")
+        return params
+
+    @staticmethod
+    def _parse_time(value, end=False):
+        """
+        Grenze eines Zeitraums: Unix-Sekunden oder ISO-8601, leer für offen.
+        Ein Datum ohne Uhrzeit als Ende schließt den ganzen Tag ein.
+        """
+        value = value.strip()
+        if not value:
+            return None
+        try:
+            timestamp = parse_timestamp(value)
+        except ValueError:
+            raise ValueError(f"Ungültiger Zeitpunkt: {value} (Unix-Sekunden oder ISO-8601)")
+        if end and DATE_ONLY.fullmatch(value):
+            timestamp += 86399
+        return timestamp
+
+    @staticmethod
+    def is_timed(params):
+        return params["from"] is not None or params["to"] is not None
+
+    @classmethod
+    def is_filtered(cls, params):
+        return (
+            params["status"] != "all"
+            or bool(params["ssid"])
+            or params["source"] != "all"
+            or cls.is_timed(params)
+        )
+
+    def _ssid_keys(self, search, ssid_match):
+        if ssid_match == "prefix":
+            start = bisect.bisect_left(self._ssids, search)
+            names = itertools.takewhile(lambda name: name.startswith(search), self._ssids[start:])
+        else:
+            names = (name for name in self._ssids if search in name)
+        return {key for name in names for key in self._by_ssid[name]}
+
+    def _timeline(self, field):
+        """
+        (Zeitstempel, Schlüssel) aufsteigend nach field sortiert; APs ohne Zeitstempel fehlen.
+        """
+        with self._lock:
+            timeline = self._timelines.get(field)
+            if timeline is None:
+                entries = sorted(
+                    (ap_data[field], key) for key, ap_data in self.positions.items() if ap_data[field] is not None
+                )
+                timeline = self._timelines[field] = ([entry[0] for entry in entries], [entry[1] for entry in entries])
+            return timeline
+
+    def time_keys(self, field, start=None, end=None):
+        """
+        Schlüssel mit start <= field <= end (Grenzen einschließlich, None = offen),
+        per Binärsuche in O(log n + k).
+        """
+        times, keys = self._timeline(field)
+        lo = 0 if start is None else bisect.bisect_left(times, start)
+        hi = len(times) if end is None else bisect.bisect_right(times, end)
+        return keys[lo:hi]
+
+    def time_bounds(self, field="ts_last"):
+        """
+        [ältester, neuester] Zeitstempel im Bestand, None ohne Zeitstempel.
+        """
+        times = self._timeline(field)[0]
+        return [times[0], times[-1]] if times else None
+
+    def match(self, params):
+        """
+        Gibt die Menge der passenden Schlüssel zurück, None wenn nicht gefiltert wird.
+        """
+        if not self.is_filtered(params):
+            return None
+        candidates = None
+
+        def narrow(keys):
+            return keys if candidates is None else candidates & keys
+
+        # Zeitraum zuerst: danach wird nur noch die (meist kleine) Treffermenge eingeschränkt
+        if self.is_timed(params):
+            candidates = set(self.time_keys(params["time"], params["from"], params["to"]))
+        if params["source"] == "none":
+            candidates = set(self.positions) - self.cracked if candidates is None else candidates - self.cracked
+        elif params["source"] != "all":
+            candidates = narrow(set(self.by_source.get(params["source"], ())))
+        if params["status"] == "cracked":
+            candidates = narrow(self.cracked)
+        elif params["status"] == "uncracked":
+            candidates = (
+                set(self.positions) - self.cracked if candidates is None else candidates - self.cracked
+            )
+        if params["ssid"]:
+            candidates = narrow(self._ssid_keys(params["ssid"], params["ssid_match"]))
+        return candidates
+
+    def _sorted_keys(self, sort):
+        with self._lock:
+            ordered = self._sorted.get(sort)
+            if ordered is None:
+                field = sort.lstrip("-")
+                descending = sort.startswith("-")
+                # Fehlende Werte immer ans Ende
+                ordered = sorted(
+                    self.positions,
+                    key=lambda key: (
+                        (self.positions[key][field] is not None) == descending,
+                        self.positions[key][field],
+                    ),
+                    reverse=descending,
+                )
+                self._sorted[sort] = ordered
+            return ordered
+
+    def search(self, params):
+        """
+        Gefilterte, sortierte Seite der APs als Liste.
+        """
+        keys = self.match(params)
+        total = len(self.positions) if keys is None else len(keys)
+        offset, limit = params["offset"], params["limit"]
+
+        if params["sort"]:
+            ordered = self._sorted_keys(params["sort"])
+            matching = ordered if keys is None else (key for key in ordered if key in keys)
+        else:
+            matching = self.positions if keys is None else (key for key in self.positions if key in keys)
+        stop = None if limit is None else offset + limit
+        page = [self.positions[key] for key in itertools.islice(matching, offset, stop)]
+
+        next_offset = offset + len(page)
+        return {
+            "generation": self.generation,
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "next_offset": next_offset if next_offset < total else None,
+            "items": page,
+        }
+
+
+class CachedBody:
+    """
+    Fertig serialisierte Antwort mit ETag (Inhalts-Hash) und bei Bedarf
+    erzeugten, danach im Speicher gehaltenen komprimierten Varianten.
+    """
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self._encoded = {"identity": body}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def encodings():
+        return ("br", "gzip") if load_brotli() is not None else ("gzip",)
+
+    def encoded(self, encoding):
+        with self._lock:
+            data = self._encoded.get(encoding)
+            if data is None:
+                if encoding == "br":
+                    data = load_brotli().compress(self.body)
+                else:
+                    data = gzip.compress(self.body, compresslevel=6)
+                self._encoded[encoding] = data
+            return data
+
+
+class SerializedPositions:
+    """
+    Serialisierter Bestand für /all, einmal pro generation erzeugt.
+    """
+
+    def __init__(self, positions, generation):
+        self.positions = positions
+        self.generation = generation
+        self.json = CachedBody(
+            json.dumps(positions, sort_keys=True, separators=(",", ":")).encode("utf-8"),
+            "application/json",
+        )
+
+    def offline(self, webgps, base_url=None):
+        """
+        Offline-Karte zu diesem Stand. Wird beim Ausliefern gestreamt und nicht im
+        Speicher gehalten; das ETag leitet sich aus dem von /all ab.
+        """
+        return OfflineMap(webgps.get_html(base_url), self.positions, self.json.etag)
+
+
+class MapPage:
+    """
+    Die Karte als statische Teile: HTML-Gerüst, CSS und JS werden einmal gebaut;
+    CSS und JS unter URLs mit Inhalts-Hash (/static/map.<hash>.js), die der Browser
+    unbegrenzt cachen darf. Werte der Instanz (Verzeichnisse, Kartenquellen) holt das
+    Skript über /config, die Offline-Karte bettet sie direkt ein (siehe document()).
+    """
+
+    STATIC_PREFIX = "/static/"
+    CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+    CSS = """        body { margin: 0; padding: 0; font-family: Arial, sans-serif; }
+        #map { height: 100vh; width: 100%; }
+        .info-panel { 
+            position: absolute; 
+            top: 10px; 
+            right: 10px; 
+            background: white; 
+            padding: 10px; 
+            border-radius: 5px; 
+            box-shadow: 0 2px 5px rgba(0,0,0,0.2);
+            z-index: 1000;
+            max-width: 300px;
+        }
+        .legend {
+            position: absolute;
+            bottom: 10px;
+            left: 10px;
+            background: white;
+            padding: 10px;
+            border-radius: 5px;
+            box-shadow: 0 2px 5px rgba(0,0,0,0.2);
+            z-index: 1000;
+        }
+        .legend-item {
+            display: flex;
+            align-items: center;
+            margin: 5px 0;
+        }
+        .legend-color {
+            width: 20px;
+            height: 20px;
+            border-radius: 50%;
+            margin-right: 10px;
+        }
+        .red { background-color: #ff4444; }
+        .green { background-color: #44ff44; }
+
+        .filter-panel {
+            position: absolute;
+            top: 10px;
+            left: 10px;
+            background: white;
+            padding: 10px;
+            border-radius: 5px;
+            box-shadow: 0 2px 5px rgba(0,0,0,0.2);
+            z-index: 1000;
+            max-width: 300px;
+        }
+        .filter-panel label, .filter-panel select, .filter-panel input {
+            display: block;
+            margin-bottom: 5px;
+            width: 100%;
+        }
+"""
+
+    BODY = """    <div id="map"></div>
+    <div class="info-panel">
+        <h3>WebGPSMap Standalone</h3>
+        <p>Handshakes-Verzeichnis:<br><span id="directories"></span></p>
+        <p id="status">Lade Positionen...</p>
+        <button onclick="loadPositions()">Aktualisieren</button>
+        <br><br>
+        <a href="/offlinemap" download="webgpsmap.html">📥 Offline-Karte herunterladen</a>
+    </div>
+    <div class="legend">
+        <h4>Legende</h4>
+        <div class="legend-item">
+            <div class="legend-color red"></div>
+            <span>Ungeknackt</span>
+        </div>
+        <div class="legend-item">
+            <div class="legend-color green"></div>
+            <span>Geknackt (Passwort bekannt)</span>
+        </div>
+    </div>
+
+    <div class="filter-panel">
+        <h4>Filter</h4>
+        <label for="statusFilter">Status:</label>
+        <select id="statusFilter" onchange="onFilterChange()">
+            <option value="all">Alle</option>
+            <option value="cracked">Geknackt</option>
+            <option value="uncracked">Ungeknackt</option>
+        </select>
+
+        <label for="ssidSearch">SSID Suche:</label>
+        <input type="text" id="ssidSearch" oninput="onFilterChange()" placeholder="Nach SSID suchen...">
+
+        <label for="sourceFilter">Passwort Quelle:</label>
+        <select id="sourceFilter" onchange="onFilterChange()">
+            <option value="all">Alle</option>
+            <option value="pwncrack">pwncrack</option>
+            <option value="wpa-sec">wpa-sec</option>
+            <option value="remote_cracking">remote_cracking</option>
+            <option value="none">Keine (Ungeknackt)</option>
+        </select>
+        <div id="timeControl" hidden>
+            <label for="timeFrom">Zuletzt gesehen: <span id="timeLabel"></span></label>
+            <input type="range" id="timeFrom" oninput="onTimeChange(this)">
+            <input type="range" id="timeTo" oninput="onTimeChange(this)">
+        </div>
+        <div id="heatmapControl" hidden>
+            <label for="heatmapChannel">Heatmap:</label>
+            <select id="heatmapChannel" onchange="onHeatmapChange()">
+                <option value="">Aus</option>
+                <option value="all">Alle APs</option>
+                <option value="cracked">Geknackte APs</option>
+            </select>
+        </div>
+    </div>
+"""
+
+    JS = """        var map = null;
+        var config = null; // Werte dieser Instanz, siehe start()
+        var allPositions = []; // APs im Kartenausschnitt (Ausschnitt-Modus)
+        var positionsByKey = {}; // Same data keyed like /all, for live updates
+        // Ein Marker je AP auf einer gemeinsamen Canvas; Filter blenden nur ein/aus
+        var renderer = null;
+        var pointLayer = null;
+        var clusterLayer = null;
+        var markersByKey = {};
+        var DEFAULT_VIEW = [48.2685195, 10.0766273];
+        // Ab so vielen APs wird nur der Kartenausschnitt (mit Clustern) vom Server geladen
+        var VIEWPORT_MODE_THRESHOLD = 50000;
+        var viewportMode = false;
+        var viewportClusters = [];
+        var viewportTotal = 0;
+        var viewportRequest = 0;
+        // Zeitregler über ts_last, [ältester, neuester]; die volle Spanne filtert nicht
+        var timeBounds = null;
+
+        function loadPositions() {
+            if (window.offlinePositions) {
+                // Offline-Karte: Positionen sind eingebettet, siehe OfflineMap
+                positionsByKey = offlinePositions;
+                applyFilters();
+                return;
+            }
+            document.getElementById('status').innerHTML = 'Lade Positionen...';
+            fetch('/positions')
+                .then(response => response.json())
+                .then(overview => {
+                    setTimeBounds(overview.time_bounds);
+                    if (overview.total > VIEWPORT_MODE_THRESHOLD) {
+                        viewportMode = true;
+                        viewportTotal = overview.total;
+                        if (overview.bounds) {
+                            map.fitBounds(overview.bounds, { padding: [20, 20] });
+                        }
+                        loadViewport();
+                    } else {
+                        viewportMode = false;
+                        loadAllPositions();
+                    }
+                })
+                .catch(error => {
+                    console.error('Error:', error);
+                    document.getElementById('status').innerHTML = 'Fehler beim Laden!';
+                });
+        }
+
+        function loadViewport() {
+            // Nur APs/Cluster im sichtbaren Ausschnitt laden; veraltete Antworten verwerfen
+            var requestId = ++viewportRequest;
+            fetch('/positions?bbox=' + map.getBounds().toBBoxString() + '&zoom=' + map.getZoom() + '&' + filterQuery())
+                .then(response => response.json())
+                .then(data => {
+                    if (requestId !== viewportRequest) return;
+                    viewportClusters = data.clusters;
+                    viewportTotal = data.total;
+                    allPositions = data.points;
+                    setTimeBounds(data.time_bounds);
+                    applyFilters(true);
+                })
+                .catch(error => {
+                    console.error('Error:', error);
+                    document.getElementById('status').innerHTML = 'Fehler beim Laden!';
+                });
+        }
+
+        function filterQuery() {
+            // Filter als Query-Parameter: im Ausschnitt-Modus filtert der Server
+            var params = new URLSearchParams({
+                status: document.getElementById('statusFilter').value,
+                ssid: document.getElementById('ssidSearch').value,
+                source: document.getElementById('sourceFilter').value
+            });
+            var range = timeWindow();
+            if (range) {
+                params.set('from', range[0]);
+                params.set('to', range[1]);
+            }
+            return params.toString();
+        }
+
+        function timeWindow() {
+            // [from, to] in Unix-Sekunden, null solange die volle Spanne gewählt ist
+            if (!timeBounds) return null;
+            var from = +document.getElementById('timeFrom').value;
+            var to = +document.getElementById('timeTo').value;
+            if (from <= timeBounds[0] && to >= timeBounds[1]) return null;
+            return [from, to];
+        }
+
+        function setTimeBounds(bounds) {
+            var from = document.getElementById('timeFrom');
+            var to = document.getElementById('timeTo');
+            var full = timeWindow() === null;
+            if (timeBounds && bounds && timeBounds[0] === bounds[0] && timeBounds[1] === bounds[1]) return;
+            timeBounds = bounds;
+            document.getElementById('timeControl').hidden = !bounds || bounds[0] === bounds[1];
+            if (!bounds) return;
+            [from, to].forEach(input => {
+                input.min = bounds[0];
+                input.max = bounds[1];
+            });
+            // Die volle Spanne wächst mit neuen APs mit, ein gewählter Zeitraum bleibt
+            if (full) {
+                from.value = bounds[0];
+                to.value = bounds[1];
+            }
+            showTimeWindow();
+        }
+
+        function showTimeWindow() {
+            var from = +document.getElementById('timeFrom').value;
+            var to = +document.getElementById('timeTo').value;
+            document.getElementById('timeLabel').textContent =
+                new Date(from * 1000).toLocaleDateString() + ' – ' + new Date(to * 1000).toLocaleDateString();
+        }
+
+        function onTimeChange(input) {
+            // Die beiden Regler dürfen sich nicht überholen
+            var from = document.getElementById('timeFrom');
+            var to = document.getElementById('timeTo');
+            if (+from.value > +to.value) {
+                if (input === from) {
+                    to.value = from.value;
+                } else {
+                    from.value = to.value;
+                }
+            }
+            showTimeWindow();
+            onFilterChange();
+        }
+
+        var filterTimer = null;
+        function onFilterChange() {
+            clearTimeout(filterTimer);
+            filterTimer = setTimeout(function() {
+                if (viewportMode) {
+                    loadViewport();
+                } else {
+                    applyFilters(true); // Kartenausschnitt beibehalten
+                }
+            }, 250);
+        }
+
+        function loadAllPositions() {
+            // Gestreamt (NDJSON): die ersten APs werden gezeichnet, bevor alles übertragen ist
+            var loaded = {};
+            var rendered = false;
+            var renderTimer = null;
+            positionsByKey = loaded;
+            streamPositions('/stream', function(batch) {
+                batch.forEach(pos => loaded[pos.ssid + '_' + pos.mac] = pos);
+                if (renderTimer === null) {
+                    renderTimer = setTimeout(function() {
+                        renderTimer = null;
+                        applyFilters(rendered);
+                        rendered = true;
+                    }, 100);
+                }
+            })
+                .then(() => {
+                    clearTimeout(renderTimer);
+                    // Nicht mehr vorhandene APs (z. B. nach "Aktualisieren") entfernen
+                    Object.keys(markersByKey).forEach(key => {
+                        if (!(key in loaded)) removeMarker(key);
+                    });
+                    applyFilters();
+                })
+                .catch(error => {
+                    console.error('Error:', error);
+                    document.getElementById('status').innerHTML = 'Fehler beim Laden!';
+                });
+        }
+
+        function streamPositions(url, onBatch) {
+            // Liest die Antwort zeilenweise, onBatch bekommt jeden empfangenen Block
+            function parse(lines) {
+                return lines.filter(line => line).map(line => JSON.parse(line));
+            }
+            return fetch(url).then(response => {
+                if (!response.ok) throw new Error('HTTP ' + response.status);
+                if (!response.body || !window.TextDecoder) {
+                    return response.text().then(text => onBatch(parse(text.split('\\n'))));
+                }
+                var reader = response.body.getReader();
+                var decoder = new TextDecoder();
+                var rest = '';
+                function read() {
+                    return reader.read().then(result => {
+                        if (result.done) {
+                            if (rest) onBatch(parse([rest]));
+                            return;
+                        }
+                        var lines = (rest + decoder.decode(result.value, { stream: true })).split('\\n');
+                        rest = lines.pop();
+                        if (lines.length) onBatch(parse(lines));
+                        return read();
+                    });
+                }
+                return read();
+            });
+        }
+
+        function connectLiveUpdates() {
+            // Server-Sent Events: neue/geänderte APs werden als Delta geschickt
+            if (!window.EventSource || location.protocol === 'file:' || window.offlinePositions) return;
+            var source = new EventSource('/events');
+            source.addEventListener('update', function(e) {
+                refreshHeatmap();
+                if (viewportMode) {
+                    loadViewport();
+                    return;
+                }
+                var delta = JSON.parse(e.data);
+                Object.assign(positionsByKey, delta.upsert || {});
+                (delta.remove || []).forEach(key => {
+                    delete positionsByKey[key];
+                    removeMarker(key);
+                });
+                applyFilters(true); // Kartenausschnitt beibehalten
+            });
+            source.addEventListener('reload', function() {
+                loadPositions();
+            });
+        }
+
+        var heatmapLayer = null;
+
+        function onHeatmapChange() {
+            // Dichte-Raster als Kacheln vom Server, statt alle Punkte zu zeichnen
+            var channel = document.getElementById('heatmapChannel').value;
+            if (heatmapLayer) {
+                map.removeLayer(heatmapLayer);
+                heatmapLayer = null;
+            }
+            if (!channel) return;
+            heatmapLayer = L.tileLayer('/heatmap/{z}/{x}/{y}.png?channel=' + channel, {
+                maxNativeZoom: config.heatmap_max_zoom,
+                maxZoom: map.getMaxZoom(),
+                opacity: 0.8
+            }).addTo(map);
+        }
+
+        function refreshHeatmap() {
+            // Kacheln werden per ETag neu geprüft, unveränderte kommen als 304
+            if (heatmapLayer) heatmapLayer.redraw();
+        }
+
+        function popupContent(pos) {
+            var popupContent = '<b>' + pos.ssid + '</b><br>' +
+                'MAC: ' + pos.mac + '<br>' +
+                'Typ: ' + pos.type + '<br>' +
+                'Genauigkeit: ' + (pos.acc ? pos.acc.toFixed(2) : 'N/A') + 'm<br>' +
+                'Zuerst gesehen: ' + new Date(pos.ts_first * 1000).toLocaleString() + '<br>' +
+                'Zuletzt gesehen: ' + new Date(pos.ts_last * 1000).toLocaleString();
+
+            if (pos.sightings > 1) {
+                popupContent += '<br>Sichtungen: ' + pos.sightings +
+                    (pos.spread !== null ? ' (Streuung ' + pos.spread.toFixed(0) + 'm)' : '');
+            }
+
+            if (Array.isArray(pos.devices) && pos.devices.length > 1) {
+                popupContent += '<br>Geräte: ' + pos.devices.join(', ');
+            }
+
+            if (pos.pass) {
+                popupContent += '<br><b>Passwort: ' + pos.pass + '</b>';
+                if (Array.isArray(pos.sources) && pos.sources.length > 0) {
+                    popupContent += '<br>Quellen: ' + pos.sources.join(', ');
+                } else if (pos.pass_source) {
+                    popupContent += '<br>Quelle: ' + pos.pass_source;
+                }
+            }
+            return popupContent;
+        }
+
+        function markerFor(key, pos) {
+            // Marker werden wiederverwendet, nur bei geänderten Daten angepasst
+            var marker = markersByKey[key];
+            if (!marker) {
+                marker = markersByKey[key] = L.circleMarker([pos.lat, pos.lng], {
+                    renderer: renderer,
+                    fillOpacity: 0.7,
+                    radius: 8
+                });
+                marker.shown = false;
+                // Popup erst beim Klick bauen
+                marker.bindPopup(layer => popupContent(layer.pos));
+            }
+            if (marker.pos !== pos) {
+                var color = pos.pass ? 'green' : 'red';
+                marker.pos = pos;
+                marker.setLatLng([pos.lat, pos.lng]);
+                marker.setStyle({ color: color, fillColor: color });
+            }
+            return marker;
+        }
+
+        function removeMarker(key) {
+            var marker = markersByKey[key];
+            if (!marker) return;
+            if (marker.shown) pointLayer.removeLayer(marker);
+            delete markersByKey[key];
+        }
+
+        function matchesFilter(pos, statusFilter, ssidSearch, sourceFilter, range) {
+            // Status Filter
+            if (statusFilter === 'cracked' && !pos.pass) return false;
+            if (statusFilter === 'uncracked' && pos.pass) return false;
+
+            // SSID Search
+            if (ssidSearch && !pos.ssid.toLowerCase().includes(ssidSearch)) return false;
+
+            // Zeitraum (Zuletzt gesehen)
+            if (range && !(pos.ts_last >= range[0] && pos.ts_last <= range[1])) return false;
+
+            // Source Filter - Updated to handle multiple sources
+            if (sourceFilter !== 'all') {
+                if (sourceFilter === 'none') {
+                    if (pos.pass) return false; // Only show uncracked
+                } else {
+                    const sources = Array.isArray(pos.sources) ? pos.sources : (pos.pass_source ? [pos.pass_source] : []);
+                    if (!sources.includes(sourceFilter)) return false; // Match against sources list
+                }
+            }
+
+            return true;
+        }
+
+        function applyFilters(keepView) {
+            var statusFilter = document.getElementById('statusFilter').value;
+            var ssidSearch = document.getElementById('ssidSearch').value.toLowerCase();
+            var sourceFilter = document.getElementById('sourceFilter').value;
+            var range = timeWindow();
+
+            var positions = positionsByKey;
+            if (viewportMode) {
+                // Im Ausschnitt-Modus hat der Server bereits gefiltert; Marker außerhalb verwerfen
+                positions = {};
+                allPositions.forEach(pos => positions[pos.ssid + '_' + pos.mac] = pos);
+                Object.keys(markersByKey).forEach(key => {
+                    if (!(key in positions)) removeMarker(key);
+                });
+            }
+
+            var count = 0;
+            var crackedCount = 0;
+            var bounds = L.latLngBounds([]);
+            var firstSeen = Infinity;
+            var lastSeen = -Infinity;
+
+            // Sichtbarkeit in place umschalten statt alle Marker neu zu erzeugen
+            Object.keys(positions).forEach(key => {
+                var pos = positions[key];
+                var marker = markerFor(key, pos);
+                var show = viewportMode || matchesFilter(pos, statusFilter, ssidSearch, sourceFilter, range);
+                if (typeof pos.ts_last === 'number') {
+                    firstSeen = Math.min(firstSeen, pos.ts_last);
+                    lastSeen = Math.max(lastSeen, pos.ts_last);
+                }
+                if (show !== marker.shown) {
+                    marker.shown = show;
+                    if (show) {
+                        pointLayer.addLayer(marker);
+                    } else {
+                        pointLayer.removeLayer(marker);
+                    }
+                }
+                if (show) {
+                    count++;
+                    if (pos.pass) crackedCount++;
+                    bounds.extend(marker.getLatLng());
+                }
+            });
+
+            if (!viewportMode) {
+                // Alle APs sind geladen: Zeitspanne hier, im Ausschnitt-Modus liefert sie der Server
+                setTimeBounds(lastSeen >= firstSeen ? [firstSeen, lastSeen] : null);
+            }
+
+            clusterLayer.clearLayers();
+            if (viewportMode) {
+                viewportClusters.forEach(cluster => {
+                    count += cluster.count;
+                    crackedCount += cluster.cracked;
+                    var marker = L.circleMarker([cluster.lat, cluster.lng], {
+                        renderer: renderer,
+                        color: cluster.cracked > 0 ? '#2a8f2a' : '#cc3333',
+                        fillColor: cluster.cracked > 0 ? '#44ff44' : '#ff4444',
+                        fillOpacity: 0.5,
+                        radius: Math.min(10 + Math.log2(cluster.count) * 3, 40)
+                    });
+                    marker.bindTooltip(cluster.count + ' APs (' + cluster.cracked + ' geknackt)');
+                    marker.on('click', function() {
+                        map.setView([cluster.lat, cluster.lng], Math.min(map.getZoom() + 2, map.getMaxZoom()));
+                    });
+                    clusterLayer.addLayer(marker);
+                });
+            }
+
+            document.getElementById('status').innerHTML = 
+                count + ' Access Points angezeigt<br>' +
+                crackedCount + ' davon geknackt' +
+                (viewportMode ? '<br>(Ausschnitt, gesamt ' + viewportTotal + ')' : '');
+
+            // Fit map to show all markers
+            if (keepView === true || viewportMode) {
+                return;
+            }
+            if (bounds.isValid()) {
+                map.fitBounds(bounds.pad(0.1));
+            } else {
+                // If no markers, reset view to default or last known good view
+                map.setView(DEFAULT_VIEW, 13);
+            }
+        }
+
+        function showDirectories(devices) {
+            var target = document.getElementById('directories');
+            devices.forEach((device, i) => {
+                if (i > 0) target.appendChild(document.createElement('br'));
+                if (devices.length > 1) target.appendChild(document.createTextNode(device.label + ': '));
+                var code = document.createElement('code');
+                code.textContent = device.directory;
+                target.appendChild(code);
+            });
+        }
+
+        function start(values) {
+            config = values;
+            map = L.map('map').setView(DEFAULT_VIEW, 13);
+            // Canvas statt eines SVG-Elements je Marker
+            renderer = L.canvas({ padding: 0.5 });
+            pointLayer = L.layerGroup().addTo(map);
+            clusterLayer = L.layerGroup().addTo(map);
+            L.tileLayer(config.tiles.url, {
+                attribution: config.tiles.attribution,
+                maxZoom: config.tiles.max_zoom
+            }).addTo(map);
+            map.on('moveend', function() {
+                if (viewportMode) loadViewport();
+            });
+            showDirectories(config.devices);
+            document.getElementById('heatmapControl').hidden = !config.heatmap;
+
+            // Load positions on page load
+            loadPositions();
+            connectLiveUpdates();
+        }
+
+        // Offline-Karte: Werte eingebettet, sonst vom Server (/config)
+        if (window.webgpsmapConfig) {
+            start(webgpsmapConfig);
+        } else {
+            fetch('/config')
+                .then(response => response.json())
+                .then(start)
+                .catch(error => {
+                    console.error('Error:', error);
+                    document.getElementById('status').innerHTML = 'Fehler beim Laden!';
+                });
+        }
+"""
+
+    def __init__(self, leaflet_css, leaflet_js):
+        self.assets = dict()  # dateiname mit hash -> CachedBody
+        css_url = self._add_asset("map", "css", self.CSS, "text/css")
+        js_url = self._add_asset("map", "js", self.JS, "application/javascript")
+        html = self.document(
+            leaflet_css + f'\n    <link rel="stylesheet" href="{css_url}" />',
+            leaflet_js + f'\n    <script src="{js_url}"></script>',
+        )
+        self.html = CachedBody(html.encode("utf-8"), "text/html")
+
+    def _add_asset(self, name, ext, content, mimetype):
+        asset = CachedBody(content.encode("utf-8"), mimetype)
+        filename = f"{name}.{asset.etag[:12]}.{ext}"
+        self.assets[filename] = asset
+        return self.STATIC_PREFIX + filename
+
+    @classmethod
+    def document(cls, head, scripts):
+        return (
+            """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>WebGPSMap - Standalone</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    """
+            + head
+            + """
+</head>
+<body>
+"""
+            + cls.BODY
+            + """
+    """
+            + scripts
+            + """
+</body>
+</html>"""
+        )
+
+    @classmethod
+    def inline(cls, leaflet_css, leaflet_js, config):
+        """
+        Eigenständiges Dokument mit eingebettetem CSS, JS und config (Offline-Karte).
+        """
+        # Werte wie die Attribution enthalten oft HTML, dürfen aber den Script-Block nicht beenden
+        config = json.dumps(config, ensure_ascii=False).replace("</", "<\\/")
+        return cls.document(
+            leaflet_css + f"\n    <style>\n{cls.CSS}    </style>",
+            leaflet_js
+            + f"\n    <script>var webgpsmapConfig = {config};</script>"
+            + f"\n    {OfflineMap.MARKER}"
+            + f"\n    <script>\n{cls.JS}    </script>",
+        )
+
+
+class OfflineMap:
+    """
+    Offline-Karte: die HTML-Vorlage mit eingebetteten Positionen, erzeugt als
+    Generator in Stücken zu CHUNK_ROWS APs. Die Positionen werden spaltenweise
+    eingebettet (Zahlen als base64-gepackte Float64-Arrays, fehlende Werte als NaN)
+    und im Browser von offlineChunk() wieder zu Objekten wie in /all dekodiert.
+    """
+
+    MARKER = "<!-- OFFLINE_DATA -->"  # Stelle in MapPage.inline() für die Daten
+    CHUNK_ROWS = 2000
+    FORMAT = "columnar-2"
+    TYPES = ("gps", "geo", "paw", "unknown")
+    NUMERIC = ("lat", "lng", "acc", "ts_first", "ts_last", "spread", "sightings")
+
+    DECODER = """<script>
+        var offlinePositions = {};
+        function offlineChunk(c) {
+            var bytes = Uint8Array.from(atob(c.num), ch => ch.charCodeAt(0));
+            var num = new Float64Array(bytes.buffer);
+            var types = ['gps', 'geo', 'paw', 'unknown'];
+            var cracked = {};
+            c.cracked.forEach(entry => cracked[entry[0]] = entry);
+            function value(x) { return isNaN(x) ? null : x; }
+            for (var i = 0, n = c.n; i < n; i++) {
+                var p = cracked[i];
+                var pos = {
+                    ssid: c.ssid[i], mac: c.mac[i], type: types[+c.type[i]],
+                    lat: value(num[i]), lng: value(num[n + i]), acc: value(num[2 * n + i]),
+                    ts_first: value(num[3 * n + i]), ts_last: value(num[4 * n + i]),
+                    spread: value(num[5 * n + i]), sightings: value(num[6 * n + i]),
+                    pass: p ? p[1] : null, pass_source: p ? p[2] : null, sources: p ? p[3] : null,
+                    devices: c.devices[c.device[i]]
+                };
+                offlinePositions[pos.ssid + '_' + pos.mac] = pos;
+            }
+        }
+    </script>
+"""
+
+    def __init__(self, html, positions, data_etag=None):
+        self.html = html
+        self.positions = positions
+        self.etag = None
+        if data_etag is not None:
+            self.etag = hashlib.sha1(
+                (self.FORMAT + data_etag + html).encode("utf-8")
+            ).hexdigest()
+
+    @staticmethod
+    def _number(value):
+        try:
+            return math.nan if value is None else float(value)
+        except (TypeError, ValueError):
+            return math.nan
+
+    def _encode(self, rows):
+        numbers = []
+        for field in self.NUMERIC:
+            numbers.extend(self._number(row[field]) for row in rows)
+        device_lists = dict()
+        device = [
+            device_lists.setdefault(tuple(row.get("devices") or ()), len(device_lists))
+            for row in rows
+        ]
+        chunk = {
+            "n": len(rows),
+            "ssid": [row["ssid"] for row in rows],
+            "mac": [row["mac"] for row in rows],
+            "type": "".join(
+                str(self.TYPES.index(row["type"]) if row["type"] in self.TYPES else 3) for row in rows
+            ),
+            "num": base64.b64encode(struct.pack(f"<{len(numbers)}d", *numbers)).decode("ascii"),
+            "cracked": [
+                [i, row["pass"], row["pass_source"], row["sources"]]
+                for i, row in enumerate(rows)
+                if row["pass"] is not None
+            ],
+            "devices": [list(labels) for labels in device_lists],
+            "device": device,
+        }
+        # "</script>" in SSIDs oder Passwörtern darf den Block nicht beenden
+        return json.dumps(chunk, separators=(",", ":")).replace("</", "<\\/")
+
+    def chunks(self):
+        """
+        Liefert die Offline-Karte als bytes-Stücke; der Bestand wird dabei nie als
+        Ganzes serialisiert.
+        """
+        head, marker, tail = self.html.partition(self.MARKER)
+        if not marker:
+            raise ValueError("Vorlage ohne Platzhalter für Offline-Daten")
+        yield head.encode("utf-8")
+        yield self.DECODER.encode("utf-8")
+        rows = iter(self.positions.values())
+        while True:
+            chunk = list(itertools.islice(rows, self.CHUNK_ROWS))
+            if not chunk:
+                break
+            yield f"<script>offlineChunk({self._encode(chunk)});</script>\n".encode("utf-8")
+        yield tail.encode("utf-8")
+
+    def write(self, path):
+        """
+        Schreibt die Offline-Karte in eine Datei (erst vollständig, dann umbenannt).
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for chunk in self.chunks():
+                f.write(chunk)
+        os.replace(tmp_path, path)
+
+
+class PositionStream:
+    """
+    Bestand als NDJSON (ein AP je Zeile) in Stücken zu CHUNK_ROWS APs für /stream:
+    die Karte zeichnet die ersten APs, bevor der Rest übertragen ist.
+    """
+
+    CHUNK_ROWS = 2000
+    MIMETYPE = "application/x-ndjson"
+
+    def __init__(self, positions, etag=None):
+        self.positions = positions
+        self.etag = etag
+
+    def chunks(self):
+        rows = iter(self.positions.values())
+        while True:
+            chunk = list(itertools.islice(rows, self.CHUNK_ROWS))
+            if not chunk:
+                break
+            yield "".join(json.dumps(ap_data, separators=(",", ":")) + "\n" for ap_data in chunk).encode("utf-8")
+
+
+def gzip_chunks(chunks, compresslevel=6, flush=False):
+    """
+    Komprimiert einen Generator von bytes-Stücken unterwegs zu einem gzip-Strom.
+    Mit flush wird jedes Stück sofort vollständig ausgegeben (Z_SYNC_FLUSH).
+    """
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if flush:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def cached_response(cached, cache_control="no-cache"):
+    """
+    Antwortet mit 304 wenn der Client den aktuellen Stand hat, sonst mit der
+    passend vorkomprimierten Variante.
+    """
+    from flask import Response, request
+
+    if request.if_none_match.contains_weak(cached.etag):
+        response = Response(status=304)
+    else:
+        encoding = "identity"
+        for candidate in cached.encodings():
+            if request.accept_encodings.quality(candidate) > 0:
+                encoding = candidate
+                break
+        response = Response(cached.encoded(encoding), mimetype=cached.mimetype)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(cached.etag, weak=True)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+def streamed_response(stream, mimetype="text/html", flush=False):
+    """
+    Wie cached_response, aber gestreamt: bei aktuellem ETag 304, sonst stream
+    (OfflineMap oder PositionStream) in Stücken und, wenn der Client es annimmt,
+    unterwegs gzip-komprimiert. Mit flush geht jedes Stück sofort vollständig raus.
+    """
+    from flask import Response, request
+
+    if stream.etag is not None and request.if_none_match.contains_weak(stream.etag):
+        response = Response(status=304)
+    elif request.accept_encodings.quality("gzip") > 0:
+        response = Response(gzip_chunks(stream.chunks(), flush=flush), mimetype=mimetype)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(stream.chunks(), mimetype=mimetype)
+    if stream.etag is not None:
+        response.set_etag(stream.etag, weak=True)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+class TileStore:
+    """
+    Lokaler Kachel-Cache für /tiles/{z}/{x}/{y}.png: eine MBTiles-Datei (SQLite,
+    TMS-Zeilen) oder ein Verzeichnis im Schema {z}/{x}/{y}.png. Häufig abgerufene
+    Kacheln (und fehlende) hält ein LRU-Cache im Speicher.
+    """
+
+    MIMETYPES = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+    def __init__(self, source, cache_size=512):
+        self.source = source
+        self.cache_size = cache_size
+        self.metadata = dict()
+        self.mimetype = "image/png"
+        self._entries = OrderedDict()  # (z, x, y) -> (data, etag) oder None
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.isdir(source):
+            return
+        if not os.path.isfile(source):
+            raise ValueError(f"Kachel-Quelle existiert nicht: {source}")
+        try:
+            self._conn = sqlite3.connect(
+                Path(source).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False
+            )
+            self.metadata = dict(self._conn.execute("SELECT name, value FROM metadata"))
+            self._conn.execute("SELECT 1 FROM tiles LIMIT 1").fetchall()
+        except sqlite3.Error as error:
+            raise ValueError(f"Keine gültige MBTiles-Datei: {source} ({error})")
+        self.mimetype = self.MIMETYPES.get(self.metadata.get("format", "png"), "image/png")
+
+    def _zoom(self, name):
+        try:
+            return int(self.metadata[name])
+        except (KeyError, ValueError):
+            return None
+
+    @property
+    def min_zoom(self):
+        return self._zoom("minzoom")
+
+    @property
+    def max_zoom(self):
+        return self._zoom("maxzoom")
+
+    @property
+    def attribution(self):
+        return self.metadata.get("attribution")
+
+    def _read(self, z, x, y):
+        if self._conn is None:
+            try:
+                with open(os.path.join(self.source, str(z), str(x), f"{y}.png"), "rb") as f:
+                    return f.read()
+            except OSError:
+                return None
+        # MBTiles zählt Zeilen von unten (TMS)
+        row = self._conn.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, (1 << z) - 1 - y),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def get(self, z, x, y):
+        """
+        Gibt (data, etag) der Kachel zurück, None wenn es sie nicht gibt.
+        """
+        key = (z, x, y)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            if z < 0 or not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+                return None
+            data = self._read(z, x, y)
+            entry = None if data is None else (bytes(data), hashlib.sha1(data).hexdigest())
+            if self.cache_size > 0:
+                self._entries[key] = entry
+                while len(self._entries) > self.cache_size:
+                    self._entries.popitem(last=False)
+            return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.cache_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class ScanResult:
+    """
+    Ergebnis von HandshakeScanner.scan().
+    """
+
+    __slots__ = ("pcap_count", "position_files", "errors")
+
+    def __init__(self):
+        self.pcap_count = 0
+        self.position_files = []  # [(pfad, os.stat_result)] in Reihenfolge der .pcap-Dateien
+        self.errors = []  # [(pfad, OSError)]
+
+
+class HandshakeScanner:
+    """
+    Ordnet in einem einzigen os.scandir-Durchlauf jedem .pcap die beste
+    Positionsdatei zu (.gps.json vor .geo.json vor .paw-gps.json). Die Zuordnung
+    läuft über ein Dictionary pro Basisname, also O(n) statt Listensuche pro
+    Datei; stat-Daten kommen aus dem DirEntry und werden nur für die gewählten
+    Positionsdateien geholt. Optional werden Unterverzeichnisse (z. B. pro Tag
+    oder Gerät) mit durchsucht.
+    """
+
+    POSITION_EXTENSIONS = (".gps.json", ".geo.json", ".paw-gps.json")  # Priorität
+    FILENAME_RE = re.compile(r"^(.+?)\.(pcap|gps\.json|geo\.json|paw-gps\.json)$")
+    _RANK = {"gps.json": 0, "geo.json": 1, "paw-gps.json": 2}
+
+    def __init__(self, recursive=False):
+        self.recursive = recursive
+
+    def scan(self, directory):
+        result = ScanResult()
+        groups = {}  # basis -> [pcap vorhanden, rang, DirEntry]
+        pcap_bases = []
+        match = self.FILENAME_RE.match
+        rank_of = self._RANK
+        pending = [directory]
+
+        while pending:
+            current = pending.pop()
+            try:
+                iterator = os.scandir(current)
+            except OSError as error:
+                if current == directory:
+                    raise
+                logging.error(f"[webgpsmap] Kann Verzeichnis nicht lesen: {current} - error: {error}")
+                continue
+            with iterator:
+                for entry in iterator:
+                    parsed = match(entry.name)
+                    if parsed is None:
+                        if self.recursive and entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        continue
+                    base = entry.path[: -len(parsed.group(2)) - 1]
+                    group = groups.get(base)
+                    if group is None:
+                        group = groups[base] = [False, 3, None]
+                    ext = parsed.group(2)
+                    if ext == "pcap":
+                        if not group[0]:
+                            group[0] = True
+                            pcap_bases.append(base)
+                    else:
+                        rank = rank_of[ext]
+                        if rank < group[1]:
+                            group[1] = rank
+                            group[2] = entry
+
+        result.pcap_count = len(pcap_bases)
+        for base in pcap_bases:
+            entry = groups[base][2]
+            if entry is None:
+                continue
+            try:
+                result.position_files.append((entry.path, entry.stat()))
+            except OSError as error:
+                result.errors.append((entry.path, error))
+        return result
+
+
+class Device:
+    """
+    Ein Handshakes-Verzeichnis im Verbund (typisch: ein Pwnagotchi). positions ist
+    der letzte Bestand nur dieses Geräts ({ssid_mac: ap_data}) und wird, wie die
+    Bestände im Snapshot, nach dem Zuweisen nicht mehr verändert.
+    """
+
+    def __init__(self, label, directory):
+        self.label = label
+        self.directory = directory
+        self.positions = dict()
+
+    def __repr__(self):
+        return f"Device({self.label!r}, {self.directory!r})"
+
+
+class SingleFlight:
+    """
+    Fasst gleichzeitige Aufrufe zusammen: solange ein Aufruf für einen Schlüssel
+    läuft, warten weitere darauf und bekommen dasselbe Ergebnis (bzw. dieselbe
+    Ausnahme), statt die Arbeit selbst noch einmal zu machen.
+    """
+
+    class _Call:
+        __slots__ = ("done", "result", "error")
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = dict()
+        self.shared = 0  # Aufrufe, die ein laufendes Ergebnis mitbenutzt haben
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class StringTable:
+    """
+    Zeichenketten hintereinander in einem UTF-8-Puffer, Zugriff über die ID. Nur
+    innerhalb von interning() werden gleiche Zeichenketten zusammengelegt; das
+    Wörterbuch dafür lebt nur solange (typisch: beim Laden der Potfiles).
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+        self._offsets = array.array("Q", [0])
+        self._ids = None
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    @contextlib.contextmanager
+    def interning(self):
+        self._ids = dict()
+        try:
+            yield self
+        finally:
+            self._ids = None
+
+    def add(self, text, intern=True):
+        ids = self._ids if intern else None
+        if ids is not None:
+            string_id = ids.get(text)
+            if string_id is not None:
+                return string_id
+        string_id = len(self._offsets) - 1
+        self._data += text.encode("utf-8")
+        self._offsets.append(len(self._data))
+        if ids is not None:
+            ids[text] = string_id
+        return string_id
+
+    def raw(self, string_id):
+        return bytes(self._data[self._offsets[string_id] : self._offsets[string_id + 1]])
+
+    def __getitem__(self, string_id):
+        return self.raw(string_id).decode("utf-8")
+
+    def memory_bytes(self):
+        return len(self._data) + self._offsets.itemsize * len(self._offsets)
+
+
+class CrackedPasswordStore:
+    """
+    Speichersparende Ablage der Potfile-Einträge für sehr große Potfiles. Pro Eintrag
+    nur Array-Elemente: BSSID als 48-Bit-Zahl, SSID und Passwort als ID in einer
+    gemeinsamen StringTable, Quellen als Bitmaske. Gefunden wird über eine offene
+    Hashtabelle (array) von Zeilennummern.
+
+    Schlüssel sind (bssid, normalisierte SSID), siehe key(). Bei mehrfach genannten
+    Schlüsseln bleibt das erste Passwort, die Quellen werden vereinigt; sources
+    kommt in der Reihenfolge der Quellen beim Anlegen des Stores.
+    """
+
+    EMPTY = -1
+    MIN_SLOTS = 1024
+
+    def __init__(self, sources):
+        self.sources = tuple(sources)
+        if len(self.sources) > 8:
+            raise ValueError(f"Zu viele Potfile-Quellen: {len(self.sources)} (maximal 8)")
+        self._source_bits = {name: 1 << i for i, name in enumerate(self.sources)}
+        self._bssids = array.array("Q")
+        self._ssids = array.array("I")
+        self._passwords = array.array("I")
+        self._masks = array.array("B")
+        self.strings = StringTable()
+        # (tabelle, maske) wird beim Vergrößern als Ganzes ersetzt, Leser brauchen keine Sperre
+        self._index = (array.array("i", [self.EMPTY]) * self.MIN_SLOTS, self.MIN_SLOTS - 1)
+
+    @staticmethod
+    def key(mac, normalized_ssid):
+        """
+        Gibt den Schlüssel für eine MAC (12 Hex-Ziffern, mit oder ohne ':') zurück,
+        None wenn sie keine gültige BSSID ist.
+        """
+        mac = mac.replace(":", "")
+        if len(mac) != 12:
+            return None
+        try:
+            return int(mac, 16), normalized_ssid
+        except ValueError:
+            return None
+
+    def __len__(self):
+        return len(self._bssids)
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    @staticmethod
+    def _hash(bssid):
+        # Multiplikatives Hashing: aufeinanderfolgende BSSIDs (gleicher Hersteller)
+        # landen verteilt; Einträge derselben BSSID teilen sich die Kette
+        return (bssid * 0x9E3779B97F4A7C15) >> 16
+
+    def _probe(self, key):
+        """
+        Gibt (zeile, slot) zurück; fehlt der Schlüssel, ist zeile -1 und slot der
+        freie Platz, an dem er einzutragen wäre.
+        """
+        table, mask = self._index
+        bssid, ssid = key
+        bssids = self._bssids
+        raw_ssid = None
+        slot = self._hash(bssid) & mask
+        while True:
+            row = table[slot]
+            if row == self.EMPTY:
+                return -1, slot
+            if bssids[row] == bssid:
+                if raw_ssid is None:
+                    raw_ssid = ssid.encode("utf-8")
+                if self.strings.raw(self._ssids[row]) == raw_ssid:
+                    return row, slot
+            slot = (slot + 1) & mask
+
+    def _find(self, key):
+        return self._probe(key)[0]
+
+    def reserve(self, rows):
+        """
+        Vergrößert die Hashtabelle vorab für rows Einträge (spart das schrittweise Umkopieren).
+        """
+        slots = len(self._index[0])
+        while rows * 2 > slots:
+            slots *= 2
+        if slots > len(self._index[0]):
+            self._resize(slots)
+
+    def add(self, key, password, source):
+        """
+        Nimmt eine Potfile-Zeile auf.
+        """
+        bit = self._source_bits[source]
+        row, slot = self._probe(key)
+        if row >= 0:
+            existing = self.strings[self._passwords[row]]
+            if password != existing:
+                bssid, ssid = key
+                logging.warning(
+                    f"[webgpsmap] Passwort-Konflikt für {bssid:012x}_{ssid}: '{existing}' vs '{password}' (behalte erstes)"
+                )
+            self._masks[row] |= bit
+            return
+        bssid, ssid = key
+        row = len(self._bssids)
+        self._bssids.append(bssid)
+        self._ssids.append(self.strings.add(ssid))
+        # Passwörter sind fast immer verschieden, Interning würde nur Speicher kosten
+        self._passwords.append(self.strings.add(password, intern=False))
+        self._masks.append(bit)
+        table = self._index[0]
+        if (row + 1) * 2 > len(table):
+            self._resize(len(table) * 2)
+        else:
+            table[slot] = row
+
+    @classmethod
+    def _insert(cls, table, mask, bssid, row):
+        slot = cls._hash(bssid) & mask
+        while table[slot] != cls.EMPTY:
+            slot = (slot + 1) & mask
+        table[slot] = row
+
+    def _resize(self, slots):
+        table = array.array("i", [self.EMPTY]) * slots
+        mask = slots - 1
+        insert = self._insert
+        for row, bssid in enumerate(self._bssids):
+            insert(table, mask, bssid, row)
+        self._index = (table, mask)
+
+    def _entry(self, row):
+        mask = self._masks[row]
+        sources = [name for name, bit in self._source_bits.items() if mask & bit]
+        source = sources[0] if len(sources) == 1 else "mixed"
+        return self.strings[self._passwords[row]], source, sources
+
+    def get(self, key):
+        """
+        Gibt (password, source, sources) zurück, None wenn der Schlüssel fehlt.
+        """
+        row = self._find(key) if key is not None else -1
+        return self._entry(row) if row >= 0 else None
+
+    def lookup_many(self, keys):
+        """
+        Schlägt viele Schlüssel auf einmal nach (z. B. alle APs eines Scans) und gibt
+        die Einträge wie get() in derselben Reihenfolge zurück. Einträge werden pro
+        Zeile nur einmal aufgebaut.
+        """
+        find = self._find
+        entries = dict()
+        result = []
+        for key in keys:
+            row = find(key) if key is not None else -1
+            if row < 0:
+                result.append(None)
+                continue
+            entry = entries.get(row)
+            if entry is None:
+                entry = entries[row] = self._entry(row)
+            result.append(entry)
+        return result
+
+    def memory_bytes(self):
+        """
+        Ungefährer Speicherbedarf der Arrays und der StringTable.
+        """
+        arrays = (self._bssids, self._ssids, self._passwords, self._masks, self._index[0])
+        return sum(a.itemsize * len(a) for a in arrays) + self.strings.memory_bytes()
+
+
+class Snapshot:
+    """
+    Unveränderlicher, vollständiger Stand des Bestands. Wird nur als Ganzes ersetzt,
+    Leser brauchen daher keine Sperre. refreshed_at ist der Zeitpunkt, zu dem der
+    Stand zuletzt als aktuell bestätigt wurde (Scan oder angewendetes Delta).
+    """
+
+    __slots__ = ("generation", "positions", "refreshed_at")
+
+    def __init__(self, generation, positions, refreshed_at=None):
+        self.generation = generation
+        self.positions = positions
+        self.refreshed_at = time.time() if refreshed_at is None else refreshed_at
+
+    def age(self):
+        return max(0.0, time.time() - self.refreshed_at)
+
+
+class BackgroundRefresher:
+    """
+    Baut den Bestand in einem eigenen Thread neu auf: alle interval Sekunden oder
+    sofort nach trigger(). Anfragen werden währenddessen aus dem letzten
+    vollständigen Snapshot beantwortet (stale-while-revalidate).
+    """
+
+    def __init__(self, refresh, interval=60.0):
+        if interval <= 0:
+            raise ValueError(f"Ungültiges Aktualisierungsintervall: {interval}")
+        self.refresh = refresh
+        self.interval = interval
+        self.runs = 0
+        self.last_duration = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        logging.info(f"[webgpsmap] Aktualisiere im Hintergrund alle {self.interval}s")
+        self._thread = threading.Thread(target=self._run, name="webgpsmap-refresh", daemon=True)
+        self._thread.start()
+
+    def trigger(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            start = time.perf_counter()
+            try:
+                self.refresh()
+            except Exception as e:
+                # Der bisherige Snapshot bleibt gültig, nächster Versuch im nächsten Intervall
+                logging.error(f"[webgpsmap] Hintergrund-Aktualisierung fehlgeschlagen: {e}")
+                continue
+            self.last_duration = time.perf_counter() - start
+            self.runs += 1
+
+
+class ChangeLog:
+    """
+    Protokoll der geänderten Schlüssel je generation für den Delta-Feed (/changes).
+    Ein Cursor besteht aus epoch (Startzeit des Prozesses) und generation; Cursor
+    eines anderen Prozesses oder aus bereits verworfenem Verlauf (älter als floor)
+    erfordern ein vollständiges Neuladen. Gespeichert werden nur Schlüssel, die
+    Daten kommen beim Abruf aus dem aktuellen Snapshot.
+    """
+
+    MAX_KEYS = 100000
+
+    def __init__(self, max_keys=MAX_KEYS):
+        self.epoch = format(int(time.time() * 1000), "x")
+        self.max_keys = max_keys
+        self.floor = 0  # ältester noch vollständig protokollierter Stand
+        self._seqs = []
+        self._batches = []  # (geänderte Schlüssel, entfernte Schlüssel) je Eintrag in _seqs
+        self._keys = 0
+        self._lock = threading.Lock()
+
+    def record(self, seq, upserted, removed):
+        upserted, removed = frozenset(upserted), frozenset(removed)
+        size = len(upserted) + len(removed)
+        with self._lock:
+            if size > self.max_keys:
+                # Zu groß zum Protokollieren: wer älter ist, muss neu laden
+                self._seqs, self._batches, self._keys = [], [], 0
+                self.floor = seq
+                return
+            self._seqs.append(seq)
+            self._batches.append((upserted, removed))
+            self._keys += size
+            while self._keys > self.max_keys:
+                self.floor = self._seqs.pop(0)
+                old_upserted, old_removed = self._batches.pop(0)
+                self._keys -= len(old_upserted) + len(old_removed)
+
+    def cursor(self, seq):
+        return f"{self.epoch}-{seq}"
+
+    def parse(self, cursor):
+        """
+        Gibt die generation eines Cursors zurück, None für einen Cursor eines anderen
+        Prozesses. "0" oder leer bedeutet "von Anfang an".
+        """
+        if cursor in (None, "", "0"):
+            return 0
+        epoch, sep, seq = cursor.partition("-")
+        if not sep or not seq.isdigit():
+            raise ValueError(f"Ungültiger Cursor: {cursor}")
+        if epoch != self.epoch:
+            return None
+        return int(seq)
+
+    def since(self, seq, upto):
+        """
+        Gibt (geänderte, entfernte) Schlüssel zwischen seq (exklusiv) und upto
+        (inklusive) zurück, None wenn dieser Verlauf nicht mehr vorliegt.
+        """
+        if seq > upto:
+            return None
+        with self._lock:
+            if seq < self.floor:
+                return None
+            start = bisect.bisect_right(self._seqs, seq)
+            stop = bisect.bisect_right(self._seqs, upto)
+            batches = self._batches[start:stop]
+        upserted, removed = set(), set()
+        for batch_upserted, batch_removed in batches:
+            upserted -= batch_removed
+            removed -= batch_upserted
+            upserted |= batch_upserted
+            removed |= batch_removed
+        return upserted, removed
+
+
+class Metrics:
+    """
+    Zähler, Histogramme und Gauges im Textformat von Prometheus (ohne zusätzliche
+    Abhängigkeit). span() misst eine Verarbeitungsstufe; zwischen start_trace() und
+    stop_trace() werden die Stufen des aktuellen Threads zusätzlich gesammelt
+    (Aufschlüsselung für das Log langsamer Anfragen).
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, prefix="webgpsmap"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._meta = dict()  # name -> (typ, hilfetext), in Reihenfolge der Registrierung
+        self._counters = dict()  # name -> {labels: wert}
+        self._histograms = dict()  # name -> {labels: [bucket-zähler..., summe, anzahl]}
+        self._gauges = dict()  # name -> funktion
+        self._local = threading.local()
+
+    def describe(self, name, kind, help_text):
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, dict())
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, dict())
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * len(self.BUCKETS) + [0.0, 0]
+            bucket = bisect.bisect_left(self.BUCKETS, value)
+            if bucket < len(self.BUCKETS):  # größere Werte zählen nur in +Inf
+                state[bucket] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def gauge(self, name, help_text, func, kind="gauge"):
+        """
+        func liefert beim Ausgeben eine Zahl oder [(labels, zahl), ...]; None wird
+        nicht ausgegeben. Mit kind="counter" für Zähler, die anderswo geführt werden.
+        """
+        self.describe(name, kind, help_text)
+        self._gauges[name] = func
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("stage_duration_seconds", elapsed, stage=stage)
+            trace = getattr(self._local, "trace", None)
+            if trace is not None:
+                trace.append((stage, elapsed))
+
+    def start_trace(self):
+        self._local.trace = []
+        self._local.started = time.perf_counter()
+
+    def stop_trace(self):
+        """
+        Gibt (dauer, [(stufe, dauer), ...]) seit start_trace() zurück.
+        """
+        trace = getattr(self._local, "trace", None) or []
+        elapsed = time.perf_counter() - getattr(self._local, "started", time.perf_counter())
+        self._local.trace = None
+        return elapsed, trace
+
+    @staticmethod
+    def _labels(key, extra=()):
+        pairs = list(key) + list(extra)
+        if not pairs:
+            return ""
+        escaped = (
+            (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in pairs
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {
+                name: {key: list(state) for key, state in series.items()}
+                for name, series in self._histograms.items()
+            }
+        names = list(self._meta) + [
+            name for name in list(counters) + list(histograms) if name not in self._meta
+        ]
+        for name in names:
+            kind, help_text = self._meta.get(name, ("counter" if name in counters else "histogram", ""))
+            full_name = f"{self.prefix}_{name}"
+            samples = []
+            if name in self._gauges:
+                try:
+                    value = self._gauges[name]()
+                except Exception as e:
+                    logging.debug(f"[webgpsmap] Gauge {name} fehlgeschlagen: {e}")
+                    continue
+                if value is None:
+                    continue
+                if not isinstance(value, list):
+                    value = [({}, value)]
+                samples = [
+                    f"{full_name}{self._labels(tuple(sorted(labels.items())))} {number}"
+                    for labels, number in value
+                    if number is not None
+                ]
+            elif kind == "counter":
+                samples = [
+                    f"{full_name}{self._labels(key)} {value}"
+                    for key, value in sorted(counters.get(name, {}).items())
+                ]
+            else:
+                for key, state in sorted(histograms.get(name, {}).items()):
+                    cumulative = 0
+                    for bound, count in zip(self.BUCKETS, state):
+                        cumulative += count
+                        samples.append(f"{full_name}_bucket{self._labels(key, [('le', bound)])} {cumulative}")
+                    samples.append(f"{full_name}_bucket{self._labels(key, [('le', '+Inf')])} {state[-1]}")
+                    samples.append(f"{full_name}_sum{self._labels(key)} {state[-2]:.6f}")
+                    samples.append(f"{full_name}_count{self._labels(key)} {state[-1]}")
+            if not samples:
+                continue
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def process_memory():
+    """
+    Speicherverbrauch des Prozesses in Byte: {"rss": aktuell, "peak": maximal}.
+    Leer, wenn unbekannt (nur Linux, /proc).
+    """
+    memory = dict()
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    memory["rss"] = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    memory["peak"] = int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return memory
+
+
 class WebGPSMapStandalone:
-    def __init__(self, handshakes_dir):
-        self.handshakes_dir = handshakes_dir
-        self.ALREADY_SENT = list()
-        self.SKIP = list()
+    POTFILES = {
+        "cracked.pwncrack.potfile": "pwncrack",
+        "wpa-sec.cracked.potfile": "wpa-sec",
+        "remote_cracking.potfile": "remote_cracking",
+    }
+
+    MIN_PARALLEL_FILES = 64  # darunter lohnt sich ein Pool nicht
+    POTFILE_LINE_BYTES = 64  # geschätzte Zeilenlänge für CrackedPasswordStore.reserve
+    EXPORT_CHUNK = 1000  # Positionsdateien pro Block bei iter_positions
+    NON_ALNUM_RE = re.compile(r"[^a-zA-Z0-9]")  # für normalize_ssid
+    OSM_TILE_URL = "https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
+    OSM_ATTRIBUTION = "© OpenStreetMap contributors"
+    LEAFLET_CDN = "https://unpkg.com/leaflet@1.9.4/dist"
+    LOCAL_TILE_URL = "/tiles/{z}/{x}/{y}.png"
+    DEFAULT_DEVICE = "local"  # Label, wenn nur handshakes_dir angegeben ist
+
+    def __init__(
+        self,
+        handshakes_dir=None,
+        index_file=None,
+        position_cache_size=100000,
+        scan_workers=1,
+        scan_pool="thread",
+        recursive=False,
+        devices=None,
+        quarantine_size=10000,
+    ):
+        # Geräte: {label: verzeichnis} bzw. [(label, verzeichnis), ...]; handshakes_dir
+        # allein entspricht einem Gerät DEFAULT_DEVICE
+        if devices is None:
+            devices = {self.DEFAULT_DEVICE: handshakes_dir} if handshakes_dir else {}
+        if isinstance(devices, dict):
+            devices = devices.items()
+        self.devices = OrderedDict()
+        for label, directory in devices:
+            self._check_device(label, directory)
+            self.devices[label] = Device(label, directory)
+        if not self.devices:
+            raise ValueError("Kein Handshakes-Verzeichnis angegeben")
+        # Erstes Gerät, für Aufrufer die nur ein Verzeichnis kennen
+        self.handshakes_dir = next(iter(self.devices.values())).directory
+
+        self.quarantine = Quarantine(quarantine_size)  # defekte Positionsdateien, siehe _skip_position_file
+        self._scan_flight = SingleFlight()
+        self.events = EventBroker()
+        self.metrics = Metrics()
+        self.watchers = dict()  # label -> DirectoryWatcher
+        # Kartenquellen für get_html(), siehe configure_map()
+        self.tile_url = self.OSM_TILE_URL
+        self.tile_attribution = self.OSM_ATTRIBUTION
+        self.tile_max_zoom = 19
+        self.leaflet_dir = None
+        self._page = None  # MapPage, siehe get_page
+        self._poll_interval = 5.0
+        self._snapshot = Snapshot(0, dict())  # letzter vollständiger Stand, siehe _publish
+        self.changelog = ChangeLog()  # geänderte Schlüssel je generation, siehe changes_since
+        self._changes_lock = threading.RLock()
+        self.refresher = None  # BackgroundRefresher, siehe start_refresher
+        self._derived = dict()  # abgeleitete Indizes je Klasse, siehe _derived_index
+        self._derived_lock = threading.Lock()
+        self._potfile_state = dict()
         self.cracked_passwords = self._load_cracked_passwords()  # Lade Passwörter beim Start
 
-        # Prüfe ob Verzeichnis existiert
-        if not os.path.exists(handshakes_dir):
-            raise ValueError(f"Handshakes-Verzeichnis existiert nicht: {handshakes_dir}")
+        # Persistenter Index, ohne Datei nur im Speicher
+        self.index = PositionIndex(index_file or ":memory:")
+        self.position_cache = PositionCache(position_cache_size)
+        if scan_pool not in ("thread", "process"):
+            raise ValueError(f"Unbekannter Scan-Pool: {scan_pool} (thread oder process)")
+        self.scan_workers = scan_workers
+        self.scan_pool = scan_pool
+        self.scanner = HandshakeScanner(recursive=recursive)
 
-        logging.info(f"[webgpsmap] Handshakes-Verzeichnis: {handshakes_dir}")
+        for device in self.devices.values():
+            logging.info(f"[webgpsmap] Handshakes-Verzeichnis ({device.label}): {device.directory}")
+        logging.info(f"[webgpsmap] Positions-Index: {self.index.db_path}")
         logging.info(f"[webgpsmap] Geladene Passwörter aus Potfiles: {len(self.cracked_passwords)}")
+        self._register_metrics()
+
+    def _register_metrics(self):
+        metrics = self.metrics
+        metrics.describe("stage_duration_seconds", "histogram", "Dauer der Verarbeitungsstufen")
+        metrics.describe("files_scanned_total", "counter", "Beim Scan gefundene Dateien")
+        metrics.describe(
+            "position_records_total", "counter", "Positionsdateien nach Herkunft (cache, index, parsed)"
+        )
+        metrics.describe("skipped_files_total", "counter", "Übersprungene (defekte) Positionsdateien")
+        metrics.describe("http_request_duration_seconds", "histogram", "Dauer der HTTP-Anfragen")
+        metrics.describe("http_requests_total", "counter", "HTTP-Anfragen nach Endpunkt und Status")
+        metrics.gauge("positions", "APs auf der Karte", lambda: len(self._snapshot.positions))
+        metrics.gauge(
+            "device_positions",
+            "APs je Gerät",
+            lambda: [({"device": d.label}, len(d.positions)) for d in list(self.devices.values())],
+        )
+        metrics.gauge("cracked_passwords", "Passwörter aus den Potfiles", lambda: len(self.cracked_passwords))
+        metrics.gauge(
+            "cracked_passwords_bytes",
+            "Speicherbedarf der Passwort-Tabelle",
+            lambda: self.cracked_passwords.memory_bytes(),
+        )
+        metrics.gauge("generation", "Stand des Bestands (steigt bei jeder Änderung)", lambda: self.generation)
+        metrics.gauge("snapshot_age_seconds", "Alter des ausgelieferten Snapshots", lambda: self._snapshot.age())
+        metrics.gauge(
+            "background_refreshes_total",
+            "Abgeschlossene Hintergrund-Aktualisierungen",
+            lambda: self.refresher.runs if self.refresher else 0,
+            kind="counter",
+        )
+        metrics.gauge(
+            "position_cache_entries", "Einträge im Positions-Cache", lambda: self.position_cache.stats()["entries"]
+        )
+        metrics.gauge(
+            "position_cache_hits_total", "Treffer im Positions-Cache", lambda: self.position_cache.hits, kind="counter"
+        )
+        metrics.gauge(
+            "position_cache_misses_total",
+            "Fehltreffer im Positions-Cache",
+            lambda: self.position_cache.misses,
+            kind="counter",
+        )
+        metrics.gauge(
+            "position_cache_evictions_total",
+            "Verdrängte Einträge im Positions-Cache",
+            lambda: self.position_cache.evictions,
+            kind="counter",
+        )
+        metrics.gauge(
+            "scans_coalesced_total",
+            "Scans, die auf einen bereits laufenden gewartet haben",
+            lambda: self._scan_flight.shared,
+            kind="counter",
+        )
+        metrics.gauge("skipped_files", "Aktuell übersprungene Positionsdateien", lambda: len(self.quarantine))
+        metrics.gauge(
+            "quarantine_hits_total",
+            "Nicht erneut geparste, bekannt defekte Positionsdateien",
+            lambda: self.quarantine.hits,
+            kind="counter",
+        )
+        metrics.gauge("sse_clients", "Verbundene Live-Update-Clients", self.events.subscriber_count)
+        metrics.gauge("resident_memory_bytes", "Aktueller Speicher (RSS)", lambda: process_memory().get("rss"))
+        metrics.gauge("peak_resident_memory_bytes", "Maximaler Speicher (RSS)", lambda: process_memory().get("peak"))
 
     def normalize_ssid(self, ssid):
-        import re
-        return re.sub(r"[^a-zA-Z0-9]", "", ssid).lower()
+        return self.NON_ALNUM_RE.sub("", ssid).lower()
+
+    def _cracked_key(self, mac, ssid):
+        return CrackedPasswordStore.key(mac, self.normalize_ssid(ssid))
+
+    def _parse_position_files(self, paths):
+        """
+        Parst mehrere Positionsdateien und gibt [(record, error), ...] in derselben
+        Reihenfolge zurück. Ab MIN_PARALLEL_FILES Dateien und scan_workers > 1 wird
+        auf einen Thread- oder Prozess-Pool verteilt (Kaltstart, SD-Karte, NFS).
+        """
+        if self.scan_workers <= 1 or len(paths) < self.MIN_PARALLEL_FILES:
+            return [_parse_position_file_safe(path) for path in paths]
+
+        logging.info(
+            f"[webgpsmap] Parse {len(paths)} Positionsdateien mit {self.scan_workers} Workern ({self.scan_pool})"
+        )
+        if self.scan_pool == "process":
+            # spawn statt fork: der Server hat bereits Threads laufen
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.scan_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            chunksize = max(1, len(paths) // (self.scan_workers * 8))
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.scan_workers, thread_name_prefix="webgpsmap-scan"
+            )
+            chunksize = 1
+        with executor:
+            # map() liefert in Eingabereihenfolge, das Ergebnis ist also deterministisch
+            return list(executor.map(_parse_position_file_safe, paths, chunksize=chunksize))
 
-    # cache 2048 items
-    @lru_cache(maxsize=2048, typed=False)
-    def _get_pos_from_file(self, path):
-        return PositionFile(path)
+    def _skip_position_file(self, pos_file, error, stat=None, quiet=False):
+        """
+        Nimmt eine defekte Positionsdatei in die Quarantäne auf; mit stat wird sie bis
+        zur nächsten Änderung nicht mehr geparst. Gemeldet wird nur der erste Fehler.
+        """
+        self.metrics.inc("skipped_files_total", reason=Quarantine.reason(error))
+        if stat is None:
+            new = self.quarantine.put(pos_file, None, None, error)
+        else:
+            new = self.quarantine.put(pos_file, stat.st_size, stat.st_mtime_ns, error)
+        if quiet or not new:
+            logging.debug(f"[webgpsmap] Überspringe {pos_file}: {error}")
+        elif isinstance(error, json.JSONDecodeError):
+            logging.error(
+                f"[webgpsmap] JSONDecodeError in: {pos_file} - error: {error}"
+            )
+        elif isinstance(error, ValueError):
+            logging.error(f"[webgpsmap] ValueError: {pos_file} - error: {error}")
+        else:
+            logging.error(f"[webgpsmap] OSError: {pos_file} - error: {error}")
+
+    def _potfiles(self):
+        """
+        Liefert (pfad, quelle) für alle bekannten Potfiles aller Geräte.
+        """
+        for device in self.devices.values():
+            for filename, source_name in self.POTFILES.items():
+                yield os.path.join(device.directory, filename), source_name
+
+    def _unskip_position_file(self, pos_file):
+        self.quarantine.discard(pos_file)
 
     def _load_cracked_passwords(self):
         """
-        Lädt Passwörter aus den verschiedenen .potfile-Dateien.
-        Gibt ein Dictionary zurück: { "BSSID_SSID": {"password": "...", "source": "...", "sources": ["..."]} }
+        Lädt Passwörter aus den verschiedenen .potfile-Dateien aller Geräte.
+        Gibt einen CrackedPasswordStore zurück (Schlüssel siehe _cracked_key).
+        Merkt sich pro Potfile Inode und Leseposition für refresh_cracked_passwords().
         """
-        cracked_data = {}
-        potfiles = {
-            "cracked.pwncrack.potfile": "pwncrack",
-            "wpa-sec.cracked.potfile": "wpa-sec",
-            "remote_cracking.potfile": "remote_cracking",
-        }
+        cracked_data = CrackedPasswordStore(dict.fromkeys(self.POTFILES.values()))
+        self._potfile_state = {}
+
+        with self.metrics.span("potfile_load"), cracked_data.strings.interning():
+            # grob eine Zeile pro POTFILE_LINE_BYTES, spart das Umkopieren der Hashtabelle
+            expected_size = 0
+            for filepath, _ in self._potfiles():
+                with contextlib.suppress(OSError):
+                    expected_size += os.path.getsize(filepath)
+            cracked_data.reserve(expected_size // self.POTFILE_LINE_BYTES)
+            for filepath, source_name in self._potfiles():
+                if os.path.exists(filepath):
+                    logging.info(f"[webgpsmap] Lade Passwörter aus {filepath}...")
+                    logging.debug(f"[webgpsmap] Quelle: {source_name}")
+                    try:
+                        self._read_potfile(cracked_data, filepath, source_name, collect_keys=False)
+                    except Exception as e:
+                        logging.error(f"[webgpsmap] Fehler beim Laden von {filepath}: {e}")
+                else:
+                    logging.debug(f"[webgpsmap] Potfile nicht gefunden: {filepath}")
+        return cracked_data
 
-        for filename, source_name in potfiles.items():
-            filepath = os.path.join(self.handshakes_dir, filename)
-            if os.path.exists(filepath):
-                logging.info(f"[webgpsmap] Lade Passwörter aus {filename}...")
-                logging.debug(f"[webgpsmap] Quelle: {source_name}")
+    def refresh_cracked_passwords(self):
+        """
+        Liest nur die seit dem letzten Aufruf angehängten Zeilen der Potfiles ein
+        (auch neu hinzugekommene Potfiles, z. B. eines neuen Geräts).
+        Wurde ein Potfile gekürzt, ersetzt oder gelöscht, werden alle neu geladen.
+        Gibt die Menge der geänderten Schlüssel zurück, None nach einem vollständigen Neuladen.
+        """
+        with self._changes_lock, self.metrics.span("potfile_refresh"):
+            changed = set()
+            for filepath, source_name in self._potfiles():
+                state = self._potfile_state.get(filepath)
+                try:
+                    stat = os.stat(filepath)
+                except FileNotFoundError:
+                    if state is None:
+                        continue
+                    stat = None
+                if (
+                    stat is None
+                    or (state is not None and state["inode"] != stat.st_ino)
+                    or (state is not None and stat.st_size < state["offset"])
+                ):
+                    # Rotation oder Kürzung: Einträge dieser Datei sind nicht mehr zuordenbar
+                    logging.info(f"[webgpsmap] {filepath} wurde ersetzt oder gekürzt, lade Potfiles neu")
+                    self.cracked_passwords = self._load_cracked_passwords()
+                    return None
+                if state is not None and stat.st_size == state["offset"]:
+                    continue
                 try:
-                    with open(filepath, "r", errors="ignore") as f:
-                        for line in f:
-                            line = line.strip()
-                            if not line:
-                                continue
-                            parts = line.split(":")
-                            if source_name == "wpa-sec" and len(parts) >= 4:
-                                # robust von rechts lesen und ESSID/Passwort am Ende nehmen
-                                bssid = parts[0].replace(":", "").upper()
-                                essid = parts[-2]
-                                password = parts[-1]
-                                if essid == "":
-                                    logging.debug(f"Skipping empty ESSID in {filename}: {line}")
-                                    continue
-                            elif (source_name == "pwncrack" or source_name == "remote_cracking") and len(parts) >= 5:
-                                bssid = parts[1].replace(":", "").upper()
-                                essid = parts[3]
-                                password = parts[4]
-                            else:
-                                logging.debug(f"Skipping malformed line in {filename}: {line}")
-                                continue
-
-                            key = f"{bssid.lower()}_{self.normalize_ssid(essid)}"
-                            if key not in cracked_data:
-                                cracked_data[key] = {"password": password, "source": source_name, "sources": [source_name]}
-                            else:
-                                # Quelle(n) zusammenführen; Passwort-Konflikte protokollieren
-                                existing = cracked_data[key]
-                                if password != existing["password"]:
-                                    logging.warning(f"[webgpsmap] Passwort-Konflikt für {key}: '{existing['password']}' vs '{password}' (behalte erstes)")
-                                if source_name not in existing.get("sources", []):
-                                    existing.setdefault("sources", []).append(source_name)
-                                # Quelle setzen: wenn identisch, lassen; sonst 'mixed'
-                                if existing.get("source") != source_name:
-                                    existing["source"] = "mixed"
+                    changed |= self._read_potfile(self.cracked_passwords, filepath, source_name)
                 except Exception as e:
-                    logging.error(f"[webgpsmap] Fehler beim Laden von {filename}: {e}")
-            else:
-                logging.debug(f"[webgpsmap] Potfile nicht gefunden: {filename}")
-        return cracked_data
+                    logging.error(f"[webgpsmap] Fehler beim Nachladen von {filepath}: {e}")
+            return changed
+
+    def _read_potfile(self, cracked_data, filepath, source_name, collect_keys=True):
+        """
+        Liest ein Potfile ab der gespeicherten Position und führt die Zeilen in cracked_data
+        (CrackedPasswordStore) zusammen. Gibt die Menge der gelesenen Schlüssel zurück
+        (None mit collect_keys=False, beim vollständigen Laden).
+        Eine unvollständige letzte Zeile (noch im Schreiben) wird erst beim nächsten Mal gelesen.
+        """
+        filename = os.path.basename(filepath)
+        state = self._potfile_state.get(filepath)
+        offset = state["offset"] if state is not None else 0
+        changed = set() if collect_keys else None
+        with open(filepath, "rb") as f:
+            inode = os.fstat(f.fileno()).st_ino
+            f.seek(offset)
+            # zeilenweise statt f.read(): große Potfiles nie komplett im Speicher
+            for raw_line in f:
+                if not raw_line.endswith(b"\n"):
+                    break
+                offset += len(raw_line)
+                line = raw_line.decode("utf-8", errors="ignore").strip()
+                if not line:
+                    continue
+                parts = line.split(":")
+                if source_name == "wpa-sec" and len(parts) >= 4:
+                    # robust von rechts lesen und ESSID/Passwort am Ende nehmen
+                    bssid = parts[0].replace(":", "").upper()
+                    essid = parts[-2]
+                    password = parts[-1]
+                    if essid == "":
+                        logging.debug(f"Skipping empty ESSID in {filename}: {line}")
+                        continue
+                elif (source_name == "pwncrack" or source_name == "remote_cracking") and len(parts) >= 5:
+                    bssid = parts[1].replace(":", "").upper()
+                    essid = parts[3]
+                    password = parts[4]
+                else:
+                    logging.debug(f"Skipping malformed line in {filename}: {line}")
+                    continue
 
-    def load_gps_from_dir(self, newest_only=False):
+                key = CrackedPasswordStore.key(bssid, self.normalize_ssid(essid))
+                if key is None:
+                    logging.debug(f"Skipping invalid BSSID in {filename}: {line}")
+                    continue
+                if changed is not None:
+                    changed.add(key)
+                # Quelle(n) zusammenführen; Passwort-Konflikte protokolliert der Store
+                cracked_data.add(key, password, source_name)
+        self._potfile_state[filepath] = {"inode": inode, "offset": offset}
+        return changed
+
+    def load_gps_from_dir(self):
         """
         Parses the gps-data from disk and enriches with cracked passwords.
+        Mit mehreren Geräten wird jedes Verzeichnis für sich (parallel) gescannt und
+        das Ergebnis pro AP (ssid_mac) zusammengeführt, siehe _merge_devices.
+
+        Gleichzeitige Scans werden zu einem zusammengefasst, die Aufrufer bekommen
+        dasselbe (nicht zu verändernde) Ergebnis. Nur die Änderungen seit einem
+        früheren Stand liefert changes_since.
+        """
+        return self._scan_flight.do("all", self._load_positions)
+
+    def iter_positions(self, chunk_size=None):
+        """
+        Liefert die AP-Einträge wie load_gps_from_dir (gleicher Scan, Index und
+        Potfile-Abgleich), aber einzeln, sobald ein Block von chunk_size Dateien
+        fertig ist, ohne den Bestand im Speicher aufzubauen (Export). Einträge
+        mehrerer Geräte (oder aus Unterverzeichnissen) müssen pro AP fusioniert
+        werden, dafür wird der Bestand doch vollständig geladen.
+        """
+        self.refresh_cracked_passwords()
+        if len(self.devices) > 1 or self.scanner.recursive:
+            yield from self.load_gps_from_dir().values()
+            return
+        device = next(iter(self.devices.values()))
+        for chunk in self._iter_device(device, chunk_size=chunk_size or self.EXPORT_CHUNK):
+            for _, ap_data in chunk:
+                yield ap_data
+
+    def _load_positions(self):
+        # Neu geknackte Passwörter ohne Neustart übernehmen (nur angehängte Zeilen)
+        self.refresh_cracked_passwords()
+
+        devices = list(self.devices.values())
+        # Stand vor dem Scan: hat ein Watcher ein Gerät inzwischen aktualisiert, ist
+        # dessen Bestand neuer als das Scan-Ergebnis (Bestände werden nur ersetzt)
+        scanned_from = [device.positions for device in devices]
+        if len(devices) > 1:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=len(devices), thread_name_prefix="webgpsmap-device"
+            ) as executor:
+                results = list(executor.map(self._load_device, devices))
+        else:
+            results = [self._load_device(devices[0])]
+
+        with self._changes_lock:
+            for device, before, positions in zip(devices, scanned_from, results):
+                if device.positions is before:
+                    device.positions = positions
+                else:
+                    logging.debug(f"[webgpsmap] {device.label}: Scan verworfen, Bestand inzwischen aktualisiert")
+            with self.metrics.span("merge"):
+                gps_data = self._merge_all()
+            delta = self._diff_positions(self._snapshot.positions, gps_data)
+            self._publish(dict(gps_data), delta)
+        # Wie bei den Watchern an verbundene Browser verteilen, damit SSE und /changes übereinstimmen
+        if (delta["upsert"] or delta["remove"]) and self.events.subscriber_count():
+            self.events.publish("update", delta)
+        logging.info(f"[webgpsmap] loaded {len(gps_data)} positions")
+        return gps_data
+
+    def _load_device(self, device):
+        """
+        Scannt das Verzeichnis eines Geräts und gibt dessen Bestand {ssid_mac: ap_data}
+        zurück, siehe _iter_device. Mehrere Sichtungen desselben APs (z. B. in
+        Unterverzeichnissen pro Tag) werden fusioniert, siehe _fuse_groups.
         """
-        handshake_dir = self.handshakes_dir
         gps_data = dict()
+        sightings = dict()  # key -> alle Einträge, nur für mehrfach gesehene APs
+        for chunk in self._iter_device(device):
+            for _, ap_data in chunk:
+                key = ap_data["ssid"] + "_" + ap_data["mac"]
+                existing = gps_data.get(key)
+                if existing is not None:
+                    sightings.setdefault(key, [existing]).append(ap_data)
+                    ap_data = self._merge_sightings(existing, ap_data)
+                gps_data[key] = ap_data
+        if sightings:
+            self._fuse_groups(gps_data, sightings)
+        return gps_data
 
-        logging.info(f"[webgpsmap] scanning {handshake_dir}")
+    def _iter_device(self, device, chunk_size=None):
+        """
+        Scannt das Verzeichnis eines Geräts und liefert dessen AP-Einträge blockweise
+        als [(positionsdatei, ap_data), ...]. Bekannte Dateien kommen aus Speicher-Cache
+        oder Index, geparst werden nur neue/geänderte.
 
-        all_files = os.listdir(handshake_dir)
-        all_pcap_files = [
-            os.path.join(handshake_dir, filename)
-            for filename in all_files
-            if filename.endswith(".pcap")
-        ]
-        all_geo_or_gps_files = []
-        for filename_pcap in all_pcap_files:
-            filename_base = filename_pcap[:-5]  # remove ".pcap"
-            filename_position = None
+        Ohne chunk_size kommt alles in einem Block. Mit chunk_size wird auch der Index
+        nur blockweise gelesen (verschwundene Dateien bleiben dann bis zum nächsten
+        vollständigen Scan darin), der Speicherbedarf hängt so nicht vom Bestand ab.
+        """
+        handshake_dir = device.directory
 
-            # Prioritize .gps.json, then .geo.json, then .paw-gps.json
-            check_order = [".gps.json", ".geo.json", ".paw-gps.json"]
-            for ext in check_order:
-                check_for = os.path.basename(filename_base) + ext
-                if check_for in all_files:
-                    filename_position = str(os.path.join(handshake_dir, check_for))
-                    break  # Found one, stop searching for this pcap
+        logging.info(f"[webgpsmap] scanning {handshake_dir}")
 
-            if filename_position is not None:
-                all_geo_or_gps_files.append(filename_position)
+        with self.metrics.span("scan"):
+            scan = self.scanner.scan(handshake_dir)
+        self.metrics.inc("files_scanned_total", scan.pcap_count, kind="pcap")
+        self.metrics.inc("files_scanned_total", len(scan.position_files), kind="position")
+        for pos_file, error in scan.errors:
+            self._skip_position_file(pos_file, error)
+        stats = dict(scan.position_files)
+        all_geo_or_gps_files = list(stats)
+        # Verschwundene Dateien aus der Quarantäne entfernen
+        self.quarantine.retain(handshake_dir, stats.keys() | {pos_file for pos_file, _ in scan.errors})
 
-        if newest_only:
-            all_geo_or_gps_files = set(all_geo_or_gps_files) - set(self.ALREADY_SENT)
+        # Reihenfolge: Speicher-Cache, dann persistenter Index, dann parsen.
+        # Der Index wird erst beim ersten Cache-Fehltreffer gelesen; verschwundene
+        # Dateien werden dabei aus dem Index entfernt.
+        indexed = None
+        removed = set()
+        parsed_count = 0
+        all_position_files = stats
 
         logging.info(
-            f"[webgpsmap] Found {len(all_geo_or_gps_files)} position-data files from {len(all_pcap_files)} handshakes. Fetching positions ..."
+            f"[webgpsmap] Found {len(all_geo_or_gps_files)} position-data files from {scan.pcap_count} handshakes. Fetching positions ..."
         )
 
-        for pos_file in all_geo_or_gps_files:
-            try:
-                pos = self._get_pos_from_file(pos_file)
-                if (
-                    not pos.type() == PositionFile.GPS
-                    and not pos.type() == PositionFile.GEO
-                    and not pos.type() == PositionFile.PAWGPS
-                ):
-                    continue
+        chunk_size = chunk_size or max(len(all_geo_or_gps_files), 1)
+        chunked = chunk_size < len(all_geo_or_gps_files)
+        for start in range(0, len(all_geo_or_gps_files), chunk_size):
+            chunk_files = all_geo_or_gps_files[start : start + chunk_size]
+            upserts = []
 
-                ssid, mac = pos.ssid(), pos.mac()
-                ssid = "unknown" if not ssid else ssid
-                if not mac:
-                    raise ValueError("Mac can't be parsed from filename")
-
-                pos_type = "unknown"
-                if pos.type() == PositionFile.GPS:
-                    pos_type = "gps"
-                elif pos.type() == PositionFile.GEO:
-                    pos_type = "geo"
-                elif pos.type() == PositionFile.PAWGPS:
-                    pos_type = "paw"
-
-                ap_data = {
-                    "ssid": ssid,
-                    "mac": mac,
-                    "type": pos_type,
-                    "lng": pos.lng(),
-                    "lat": pos.lat(),
-                    "acc": pos.accuracy(),
-                    "ts_first": pos.timestamp_first(),
-                    "ts_last": pos.timestamp_last(),
-                    "pass": None,
-                    "pass_source": None,
-                    "sources": None,
-                }
+            # 1. Durchlauf: Cache/Index mit den stat-Daten des Scans, Dateien ohne gültigen Eintrag sammeln
+            results = []  # [pos_file, stat, record] in Verzeichnisreihenfolge
+            to_parse = []
+            from_index = 0
+            skipped = 0
+            with self.metrics.span("lookup"):
+                for pos_file in chunk_files:
+                    stat = stats[pos_file]
+                    record = self.position_cache.get(pos_file, stat.st_size, stat.st_mtime_ns)
+                    if record is None and self.quarantine.get(pos_file, stat.st_size, stat.st_mtime_ns):
+                        # bekannt defekt und unverändert: weder parsen noch loggen
+                        skipped += 1
+                    elif record is None:
+                        if indexed is None:
+                            with self.metrics.span("index_read"):
+                                if chunked:
+                                    indexed = self.index.lookup(chunk_files)
+                                else:
+                                    indexed = self.index.entries(handshake_dir)
+                                    removed = set(indexed).difference(all_position_files)
+                        entry = indexed.get(pos_file)
+                        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                            record = entry[2]
+                            from_index += 1
+                            self.position_cache.put(pos_file, stat.st_size, stat.st_mtime_ns, record)
+                        else:
+                            to_parse.append(len(results))
+                    results.append([pos_file, stat, record])
+            self.metrics.inc(
+                "position_records_total", len(results) - len(to_parse) - from_index - skipped, source="cache"
+            )
+            self.metrics.inc("position_records_total", from_index, source="index")
+            if chunked:
+                indexed = None  # nächster Block liest seine eigenen Einträge
 
-                # Check for cracked password from potfiles
-                cracked_key = f"{mac.lower()}_{self.normalize_ssid(ssid)}"
-                if cracked_key in self.cracked_passwords:
-                    ap_data["pass"] = self.cracked_passwords[cracked_key]["password"]
-                    ap_data["pass_source"] = self.cracked_passwords[cracked_key]["source"]
-                    ap_data["sources"] = self.cracked_passwords[cracked_key].get("sources", [])
+            # 2. Durchlauf: neue/geänderte Dateien parsen, optional parallel
+            with self.metrics.span("parse"):
+                parsed = self._parse_position_files([results[i][0] for i in to_parse])
+            chunk_parsed = 0
+            for i, (record, error) in zip(to_parse, parsed):
+                pos_file, stat, _ = results[i]
+                if error is not None:
+                    self._skip_position_file(pos_file, error, stat)
+                    continue
+                if record is None:
+                    continue
+                chunk_parsed += 1
+                self._unskip_position_file(pos_file)
+                upserts.append((pos_file, stat.st_size, stat.st_mtime_ns, record))
+                self.position_cache.put(pos_file, stat.st_size, stat.st_mtime_ns, record)
+                results[i][2] = record
+            parsed_count += chunk_parsed
 
-                gps_data[ssid + "_" + mac] = ap_data
+            self.metrics.inc("position_records_total", chunk_parsed, source="parsed")
 
-                self.ALREADY_SENT.append(pos_file)
-            except json.JSONDecodeError as error:
-                self.SKIP.append(pos_file)
-                logging.error(
-                    f"[webgpsmap] JSONDecodeError in: {pos_file} - error: {error}"
+            # 3. Ergebnis in fester Reihenfolge zusammenführen (inkl. Abgleich mit den Potfiles)
+            with self.metrics.span("build"):
+                results = [(pos_file, record) for pos_file, _, record in results if record is not None]
+                cracked = self.cracked_passwords.lookup_many(
+                    self._cracked_key(record.mac, record.ssid) for _, record in results
                 )
-                continue
-            except ValueError as error:
-                self.SKIP.append(pos_file)
-                logging.error(f"[webgpsmap] ValueError: {pos_file} - error: {error}")
-                continue
-            except OSError as error:
-                self.SKIP.append(pos_file)
-                logging.error(f"[webgpsmap] OSError: {pos_file} - error: {error}")
-                continue
-        logging.info(f"[webgpsmap] loaded {len(gps_data)} positions")
-        return gps_data
+                chunk = [
+                    (pos_file, self._build_ap_data(record, device.label, entry))
+                    for (pos_file, record), entry in zip(results, cracked)
+                ]
+
+            try:
+                if upserts or removed:
+                    with self.metrics.span("index_write"):
+                        self.index.update(handshake_dir, upserts, removed)
+            except sqlite3.Error as error:
+                logging.error(f"[webgpsmap] Fehler beim Schreiben des Positions-Index: {error}")
+            yield chunk
+
+        logging.info(
+            f"[webgpsmap] {device.label}: {parsed_count} Positionsdateien neu geparst, {len(removed)} aus dem Index entfernt"
+        )
+        logging.debug(f"[webgpsmap] Positions-Cache: {self.position_cache.stats()}")
 
-    def get_html(self):
+    def _merge_all(self):
+        return self._merge_devices([device.positions for device in self.devices.values()])
+
+    def _merge_devices(self, device_positions):
         """
-        Returns the html page with embedded map and filter options
+        Führt die Bestände mehrerer Geräte ({ssid_mac: ap_data}, in Geräte-Reihenfolge)
+        zusammen. Sehen mehrere Geräte denselben AP (gleicher Schlüssel ssid_mac wie in
+        _load_device), bleibt ein Eintrag übrig, siehe _merge_sightings; andere SSIDs
+        auf derselben BSSID bleiben wie auf einem einzelnen Gerät getrennt.
         """
-        html_template = (
-            """<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <title>WebGPSMap - Standalone</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css" />
-    <style>
-        body { margin: 0; padding: 0; font-family: Arial, sans-serif; }
-        #map { height: 100vh; width: 100%; }
-        .info-panel { 
-            position: absolute; 
-            top: 10px; 
-            right: 10px; 
-            background: white; 
-            padding: 10px; 
-            border-radius: 5px; 
-            box-shadow: 0 2px 5px rgba(0,0,0,0.2);
-            z-index: 1000;
-            max-width: 300px;
-        }
-        .legend {
-            position: absolute;
-            bottom: 10px;
-            left: 10px;
-            background: white;
-            padding: 10px;
-            border-radius: 5px;
-            box-shadow: 0 2px 5px rgba(0,0,0,0.2);
-            z-index: 1000;
-        }
-        .legend-item {
-            display: flex;
-            align-items: center;
-            margin: 5px 0;
-        }
-        .legend-color {
-            width: 20px;
-            height: 20px;
-            border-radius: 50%;
-            margin-right: 10px;
-        }
-        .red { background-color: #ff4444; }
-        .green { background-color: #44ff44; }
+        if len(device_positions) == 1:
+            return dict(device_positions[0])
 
-        .filter-panel {
-            position: absolute;
-            top: 10px;
-            left: 10px;
-            background: white;
-            padding: 10px;
-            border-radius: 5px;
-            box-shadow: 0 2px 5px rgba(0,0,0,0.2);
-            z-index: 1000;
-            max-width: 300px;
-        }
-        .filter-panel label, .filter-panel select, .filter-panel input {
-            display: block;
-            margin-bottom: 5px;
-            width: 100%;
+        merged = dict()
+        sightings = dict()  # key -> zusammengeführte Einträge, siehe _fuse_groups
+        for positions in device_positions:
+            for key, ap_data in positions.items():
+                existing = merged.get(key)
+                if existing is None:
+                    merged[key] = ap_data
+                    continue
+                parts = sightings.pop(key, None) or [existing]
+                merged[key] = self._merge_sightings(existing, ap_data)
+                sightings[key] = parts + [ap_data]
+        if sightings:
+            self._fuse_groups(merged, sightings)
+        return merged
+
+    def _fuse_groups(self, positions, groups):
+        """
+        Ersetzt Position, Genauigkeit (acc), Streuung (spread) und Zeitraum der Einträge
+        in positions, für die groups ({key: [ap_data, ...]}) mehrere Sichtungen enthält,
+        durch die aus allen Sichtungen fusionierten Werte (SightingStore, in einem
+        Durchlauf für alle Gruppen). Die Einträge werden dabei ersetzt, nicht verändert.
+        """
+        store = SightingStore()
+        for key, entries in groups.items():
+            for ap_data in entries:
+                store.add(key, ap_data)
+        with self.metrics.span("fuse"):
+            fused = store.fuse()
+        for key, values in zip(store.groups, fused):
+            ap_data = dict(positions[key])
+            ap_data.update(values)
+            positions[key] = ap_data
+
+    @staticmethod
+    def _merge_sightings(existing, other):
+        """
+        Fasst zwei Einträge desselben APs (derselbe Schlüssel ssid_mac, auf einem oder
+        verschiedenen Geräten) zusammen: Position der jüngsten Sichtung,
+        Zeitraum über beide, alle Geräte, ein bekanntes Passwort gewinnt. Die Position
+        ersetzt danach _fuse_groups.
+        """
+        newer, older = (other, existing) if (other["ts_last"] or 0) > (existing["ts_last"] or 0) else (existing, other)
+        combined = dict(newer)
+        first = [ts for ts in (existing["ts_first"], other["ts_first"]) if ts is not None]
+        last = [ts for ts in (existing["ts_last"], other["ts_last"]) if ts is not None]
+        combined["ts_first"] = min(first) if first else None
+        combined["ts_last"] = max(last) if last else None
+        combined["devices"] = existing["devices"] + [
+            label for label in other["devices"] if label not in existing["devices"]
+        ]
+        if combined["pass"] is None and older["pass"] is not None:
+            combined["pass"] = older["pass"]
+            combined["pass_source"] = older["pass_source"]
+            combined["sources"] = older["sources"]
+        return combined
+
+    def _build_ap_data(self, record, device_label, cracked=False):
+        """
+        Baut aus dem PositionRecord einer Positionsdatei den AP-Eintrag für die Karte.
+        cracked ist der bereits nachgeschlagene Potfile-Eintrag (siehe lookup_many),
+        ohne Angabe wird er hier nachgeschlagen.
+        """
+        pos_type = "unknown"
+        if record.type == PositionFile.GPS:
+            pos_type = "gps"
+        elif record.type == PositionFile.GEO:
+            pos_type = "geo"
+        elif record.type == PositionFile.PAWGPS:
+            pos_type = "paw"
+
+        ap_data = {
+            "ssid": record.ssid,
+            "mac": record.mac,
+            "type": pos_type,
+            "lng": record.lng,
+            "lat": record.lat,
+            "acc": record.acc,
+            "ts_first": record.ts_first,
+            "ts_last": record.ts_last,
+            "pass": None,
+            "pass_source": None,
+            "sources": None,
+            "devices": [device_label],
+            "sightings": 1,
+            "spread": None,  # Meter, erst bei mehreren Sichtungen, siehe _fuse_groups
         }
-    </style>
-</head>
-<body>
-    <div id="map"></div>
-    <div class="info-panel">
-        <h3>WebGPSMap Standalone</h3>
-        <p>Handshakes-Verzeichnis:<br><code>"""
-            + self.handshakes_dir
-            + """</code></p>
-        <p id="status">Lade Positionen...</p>
-        <button onclick="loadPositions()">Aktualisieren</button>
-        <br><br>
-        <a href="/offlinemap" download="webgpsmap.html">📥 Offline-Karte herunterladen</a>
-    </div>
-    <div class="legend">
-        <h4>Legende</h4>
-        <div class="legend-item">
-            <div class="legend-color red"></div>
-            <span>Ungeknackt</span>
-        </div>
-        <div class="legend-item">
-            <div class="legend-color green"></div>
-            <span>Geknackt (Passwort bekannt)</span>
-        </div>
-    </div>
+        if cracked is False:
+            cracked = self.cracked_passwords.get(self._cracked_key(record.mac, record.ssid))
+        self._enrich(ap_data, cracked)
+        return ap_data
 
-    <div class="filter-panel">
-        <h4>Filter</h4>
-        <label for="statusFilter">Status:</label>
-        <select id="statusFilter" onchange="applyFilters()">
-            <option value="all">Alle</option>
-            <option value="cracked">Geknackt</option>
-            <option value="uncracked">Ungeknackt</option>
-        </select>
+    def _enrich(self, ap_data, cracked):
+        """
+        Ergänzt einen AP-Eintrag um das geknackte Passwort aus den Potfiles
+        (cracked: (password, source, sources) oder None).
+        """
+        if cracked is not None:
+            ap_data["pass"], ap_data["pass_source"], sources = cracked
+            ap_data["sources"] = list(sources)
+        else:
+            ap_data["pass"] = None
+            ap_data["pass_source"] = None
+            ap_data["sources"] = None
+
+    def _position_file_for(self, filename_base):
+        """
+        Gibt die Positionsdatei zu einem Handshake (Pfad ohne Endung) zurück,
+        sofern das .pcap existiert. Reihenfolge wie in load_gps_from_dir.
+        """
+        if not os.path.exists(filename_base + ".pcap"):
+            return None
+        for ext in [".gps.json", ".geo.json", ".paw-gps.json"]:
+            if os.path.exists(filename_base + ext):
+                return filename_base + ext
+        return None
+
+    def apply_changes(self, filenames, device=None):
+        """
+        Verarbeitet geänderte Dateien im Handshakes-Verzeichnis eines Geräts (vom
+        DirectoryWatcher, Namen relativ zum Verzeichnis) und gibt das Delta zurück:
+        {"upsert": {key: ap_data}, "remove": [key, ...]}. Ohne device ist das erste
+        Gerät gemeint. Bei filenames=None ist unbekannt was sich geändert hat, dann
+        wird das Verzeichnis des Geräts neu gescannt.
+        """
+        if device is None:
+            device = next(iter(self.devices.values()))
+        elif not isinstance(device, Device):
+            device = self.devices[device]
+        with self._changes_lock, self.metrics.span("apply_changes"):
+            return self._apply_changes(filenames, device)
+
+    def _apply_changes(self, filenames, device):
+        previous = self._snapshot.positions
+        if filenames is None:
+            self.refresh_cracked_passwords()
+            device.positions = self._load_device(device)
+            current = self._merge_all()
+            delta = self._diff_positions(previous, current)
+            self._publish(current, delta)
+            return delta
+
+        # Copy-on-write: bereits ausgelieferte Bestände werden nie verändert
+        touched = set()
+        if any(os.path.basename(name) in self.POTFILES for name in filenames):
+            # Neue Passwörter: nur betroffene APs neu anreichern, ohne Positionsdateien zu lesen
+            touched |= self._reenrich(self.refresh_cracked_passwords())
+
+        positions = dict(device.positions)
+        handshake_dir = device.directory
+        bases = set()
+        for name in filenames:
+            parsed = HandshakeScanner.FILENAME_RE.match(os.path.basename(name))
+            if parsed is not None:
+                bases.add(os.path.join(handshake_dir, name[: -len(parsed.group(2)) - 1]))
+
+        # Mehrfach gesehene APs (bei Unterverzeichnissen jeder bekannte) lassen sich nicht
+        # über eine einzelne Datei ersetzen: Gerät dann über den Index neu laden und fusionieren
+        for filename_base in bases:
+            existing = positions.get(self._key_from_base(os.path.basename(filename_base)))
+            if existing is not None and (self.scanner.recursive or existing["sightings"] > 1):
+                return self._apply_changes(None, device)
+
+        upserts = []
+        removed = []
+        for filename_base in bases:
+            key = self._key_from_base(os.path.basename(filename_base))
+            pos_file = self._position_file_for(filename_base)
+            # Einträge anderer Endungen desselben Handshakes gelten nicht mehr
+            for ext in [".gps.json", ".geo.json", ".paw-gps.json"]:
+                if filename_base + ext != pos_file:
+                    removed.append(filename_base + ext)
+                    self.position_cache.discard(filename_base + ext)
+            if pos_file is None:
+                if key is not None:
+                    positions.pop(key, None)
+                    touched.add(key)
+                continue
+            stat = None
+            try:
+                stat = os.stat(pos_file)
+                record = parse_position_file(pos_file)
+                if record is None:
+                    continue
+                self._unskip_position_file(pos_file)
+                upserts.append((pos_file, stat.st_size, stat.st_mtime_ns, record))
+                self.position_cache.put(pos_file, stat.st_size, stat.st_mtime_ns, record)
+                ap_data = self._build_ap_data(record, device.label)
+                key = ap_data["ssid"] + "_" + ap_data["mac"]
+                positions[key] = ap_data
+                touched.add(key)
+            except (json.JSONDecodeError, ValueError, OSError) as error:
+                # Halb geschriebene Dateien: der nächste Schreibvorgang ändert mtime, dann erneut
+                self._skip_position_file(pos_file, error, stat, quiet=True)
+                continue
+        device.positions = positions
 
-        <label for="ssidSearch">SSID Suche:</label>
-        <input type="text" id="ssidSearch" onkeyup="applyFilters()" placeholder="Nach SSID suchen...">
+        try:
+            self.index.update(handshake_dir, upserts, removed)
+        except sqlite3.Error as error:
+            logging.error(f"[webgpsmap] Fehler beim Schreiben des Positions-Index: {error}")
+        if len(self.devices) == 1:
+            current = dict(previous)
+            for key in touched:
+                if key in positions:
+                    current[key] = positions[key]
+                else:
+                    current.pop(key, None)
+            delta = self._diff_positions(previous, current, touched)
+        else:
+            # Derselbe AP kann auch auf anderen Geräten gesehen worden sein
+            current = self._merge_all()
+            delta = self._diff_positions(previous, current)
+        self._publish(current, delta)
+        return delta
 
-        <label for="sourceFilter">Passwort Quelle:</label>
-        <select id="sourceFilter" onchange="applyFilters()">
-            <option value="all">Alle</option>
-            <option value="pwncrack">pwncrack</option>
-            <option value="wpa-sec">wpa-sec</option>
-            <option value="remote_cracking">remote_cracking</option>
-            <option value="none">Keine (Ungeknackt)</option>
-        </select>
-    </div>
+    def _reenrich(self, changed_keys):
+        """
+        Reichert die Bestände aller Geräte nach geänderten Potfiles neu an (copy-on-write),
+        bei changed_keys=None alle Einträge. Gibt die betroffenen Schlüssel zurück.
+        """
+        touched = set()
+        for device in self.devices.values():
+            selected = [
+                (key, ap_data, cracked_key)
+                for key, ap_data in device.positions.items()
+                for cracked_key in (self._cracked_key(ap_data["mac"], ap_data["ssid"]),)
+                if changed_keys is None or cracked_key in changed_keys
+            ]
+            if not selected:
+                continue
+            positions = dict(device.positions)
+            cracked = self.cracked_passwords.lookup_many(cracked_key for _, _, cracked_key in selected)
+            for (key, ap_data, _), entry in zip(selected, cracked):
+                ap_data = dict(ap_data)
+                self._enrich(ap_data, entry)
+                positions[key] = ap_data
+                touched.add(key)
+            device.positions = positions
+        return touched
 
-    <script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
-    <script>
-        var map = L.map('map').setView([48.2685195, 10.0766273], 13);
-        var allPositions = []; // Store all loaded positions
-        var markers = [];
+    def _check_device(self, label, directory):
+        if not label:
+            raise ValueError(f"Gerät ohne Label: {directory}")
+        if label in self.devices:
+            raise ValueError(f"Gerät doppelt angegeben: {label}")
+        # Prüfe ob Verzeichnis existiert
+        if not directory or not os.path.exists(directory):
+            raise ValueError(f"Handshakes-Verzeichnis existiert nicht: {directory}")
 
-        L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
-            attribution: '© OpenStreetMap contributors'
-        }).addTo(map);
+    def add_device(self, label, directory):
+        """
+        Nimmt ein weiteres Gerät zur Laufzeit in den Verbund auf. Gescannt wird nur
+        dessen Verzeichnis; die übrigen Geräte werden lediglich neu zusammengeführt.
+        Gibt das Delta wie apply_changes zurück (und verteilt es, falls Watcher laufen).
+        """
+        with self._changes_lock:
+            self._check_device(label, directory)
+            device = self.devices[label] = Device(label, directory)
+            logging.info(f"[webgpsmap] Neues Gerät {label}: {directory}")
+            # Potfiles des neuen Geräts sind noch unbekannt und werden vollständig gelesen
+            touched = self._reenrich(self.refresh_cracked_passwords())
+            device.positions = self._load_device(device)
+            previous = self._snapshot.positions
+            current = self._merge_all()
+            delta = self._diff_positions(previous, current)
+            self._publish(current, delta)
+            logging.debug(f"[webgpsmap] {len(touched)} Einträge neu angereichert")
+        if self.watchers:
+            self._start_device_watcher(device, self._poll_interval)
+            if delta["upsert"] or delta["remove"]:
+                self.events.publish("update", delta)
+        return delta
 
-        function loadPositions() {
-            document.getElementById('status').innerHTML = 'Lade Positionen...';
-            fetch('/all')
-                .then(response => response.json())
-                .then(data => {
-                    allPositions = Object.values(data); // Convert object to array
-                    positionsLoaded = true;
-                    applyFilters(); // Apply filters after loading
-                })
-                .catch(error => {
-                    console.error('Error:', error);
-                    document.getElementById('status').innerHTML = 'Fehler beim Laden!';
-                });
+    def _key_from_base(self, basename):
+        """
+        Leitet den Kartenschlüssel (ssid_mac) aus dem Dateinamen ohne Endung ab.
+        """
+        parsed = re.search(r"(?:(.+)_)?([a-zA-Z0-9]{12})$", basename)
+        if not parsed:
+            return None
+        ssid, mac = parsed.groups()
+        return ("unknown" if not ssid else ssid) + "_" + mac
+
+    @staticmethod
+    def _diff_positions(previous, current, keys=None):
+        """
+        Vergleicht zwei Bestände; mit keys werden nur diese Schlüssel geprüft.
+        """
+        if keys is None:
+            keys = set(previous) | set(current)
+        upsert = {
+            key: current[key]
+            for key in keys
+            if key in current and previous.get(key) != current[key]
         }
+        remove = [key for key in keys if key in previous and key not in current]
+        return {"upsert": upsert, "remove": remove}
 
-        function applyFilters() {
-            // Clear existing markers
-            markers.forEach(marker => map.removeLayer(marker));
-            markers = [];
+    @property
+    def generation(self):
+        """
+        Stand des Bestands, wird bei jeder Änderung erhöht.
+        """
+        return self._snapshot.generation
 
-            var statusFilter = document.getElementById('statusFilter').value;
-            var ssidSearch = document.getElementById('ssidSearch').value.toLowerCase();
-            var sourceFilter = document.getElementById('sourceFilter').value;
+    def _publish(self, positions, delta):
+        """
+        Ersetzt den Snapshot atomar (Aufrufer hält _changes_lock) und protokolliert
+        delta (siehe _diff_positions) für den Delta-Feed. Ohne Änderung bleibt der
+        Bestand gleich und nur der Zeitpunkt der Bestätigung wird erneuert.
+        """
+        previous = self._snapshot
+        if delta["upsert"] or delta["remove"]:
+            generation = previous.generation + 1
+            self.changelog.record(generation, delta["upsert"], delta["remove"])
+            self._snapshot = Snapshot(generation, positions)
+        else:
+            self._snapshot = Snapshot(previous.generation, previous.positions)
 
-            var filteredPositions = allPositions.filter(pos => {
-                // Status Filter
-                if (statusFilter === 'cracked' && !pos.pass) return false;
-                if (statusFilter === 'uncracked' && pos.pass) return false;
+    def changes_since(self, cursor, snapshot=None):
+        """
+        Gibt die seit cursor hinzugekommenen oder geänderten (upsert) und entfernten
+        (remove) Positionen zusammen mit dem neuen Cursor zurück; der Aufwand hängt
+        nur von der Zahl der Änderungen ab. Ist der Verlauf nicht mehr vorhanden
+        (oder der Cursor von einem anderen Prozess), wird mit reset der vollständige
+        Bestand geliefert. Ein ungültiger Cursor löst ValueError aus.
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        seq = self.changelog.parse(cursor)
+        keys = None if seq is None else self.changelog.since(seq, snapshot.generation)
+        result = {"cursor": self.changelog.cursor(snapshot.generation), "reset": keys is None}
+        if keys is None:
+            result["upsert"] = snapshot.positions
+            result["remove"] = []
+            return result
+        upserted, removed = keys
+        positions = snapshot.positions
+        # Spätere Änderungen bis zum Snapshot entscheiden, ob ein Schlüssel noch existiert
+        result["upsert"] = {key: positions[key] for key in upserted if key in positions}
+        result["remove"] = sorted(key for key in upserted | removed if key not in positions)
+        return result
 
-                // SSID Search
-                if (ssidSearch && !pos.ssid.toLowerCase().includes(ssidSearch)) return false;
+    def snapshot(self):
+        """
+        Gibt den letzten vollständigen Snapshot zurück. Mit laufendem Watcher oder
+        Hintergrund-Aktualisierung ohne zu warten, sonst wird vorher (inkrementell
+        über den Index) neu gescannt.
+        """
+        if not self.watchers and self.refresher is None:
+            self.load_gps_from_dir()
+        return self._snapshot
 
-                // Source Filter - Updated to handle multiple sources
-                if (sourceFilter !== 'all') {
-                    if (sourceFilter === 'none') {
-                        if (pos.pass) return false; // Only show uncracked
-                    } else {
-                        const sources = Array.isArray(pos.sources) ? pos.sources : (pos.pass_source ? [pos.pass_source] : []);
-                        if (!sources.includes(sourceFilter)) return false; // Match against sources list
-                    }
-                }
+    def current_positions(self):
+        """
+        Gibt (generation, positions) des aktuellen Snapshots zurück, siehe snapshot().
+        Der zurückgegebene Bestand wird nicht mehr verändert.
+        """
+        snapshot = self.snapshot()
+        return snapshot.generation, snapshot.positions
 
-                return true;
-            });
+    def _derived_index(self, index_class, snapshot=None):
+        """
+        Gibt einen aus dem Snapshot abgeleiteten Index zurück; neu aufgebaut wird er
+        nur, wenn sich der Bestand (generation) geändert hat.
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
+        with self._derived_lock:
+            index = self._derived.get(index_class)
+            if index is None or index.generation != snapshot.generation:
+                with self.metrics.span(f"derive_{index_class.__name__}"):
+                    index = index_class(snapshot.positions, snapshot.generation)
+                # Ein älterer Snapshot verdrängt keinen bereits neueren Index
+                if index_class not in self._derived or self._derived[index_class].generation < index.generation:
+                    self._derived[index_class] = index
+            return index
 
-            var count = 0;
-            var crackedCount = 0;
+    def get_spatial_index(self, snapshot=None):
+        return self._derived_index(SpatialIndex, snapshot)
 
-            filteredPositions.forEach(pos => {
-                count++;
+    def get_filter_index(self, snapshot=None):
+        return self._derived_index(FilterIndex, snapshot)
 
-                var color = pos.pass ? 'green' : 'red';
-                if (pos.pass) crackedCount++;
+    def get_serialized_positions(self, snapshot=None):
+        return self._derived_index(SerializedPositions, snapshot)
 
-                var marker = L.circleMarker([pos.lat, pos.lng], {
-                    color: color,
-                    fillColor: color,
-                    fillOpacity: 0.7,
-                    radius: 8
-                }).addTo(map);
-
-                var popupContent = '<b>' + pos.ssid + '</b><br>' +
-                    'MAC: ' + pos.mac + '<br>' +
-                    'Typ: ' + pos.type + '<br>' +
-                    'Genauigkeit: ' + (pos.acc ? pos.acc.toFixed(2) : 'N/A') + 'm<br>' +
-                    'Zuerst gesehen: ' + new Date(pos.ts_first * 1000).toLocaleString() + '<br>' +
-                    'Zuletzt gesehen: ' + new Date(pos.ts_last * 1000).toLocaleString();
-
-                if (pos.pass) {
-                    popupContent += '<br><b>Passwort: ' + pos.pass + '</b>';
-                    if (Array.isArray(pos.sources) && pos.sources.length > 0) {
-                        popupContent += '<br>Quellen: ' + pos.sources.join(', ');
-                    } else if (pos.pass_source) {
-                        popupContent += '<br>Quelle: ' + pos.pass_source;
-                    }
-                }
+    def get_heatmap_index(self, snapshot=None):
+        return self._derived_index(HeatmapIndex, snapshot)
 
-                marker.bindPopup(popupContent);
-                markers.push(marker);
-            });
+    def start_refresher(self, interval=60.0):
+        """
+        Baut den Bestand im Hintergrund alle interval Sekunden (oder nach
+        request_refresh()) neu auf; Anfragen scannen danach nicht mehr selbst.
+        """
+        if self.refresher is None:
+            self.refresher = BackgroundRefresher(self.load_gps_from_dir, interval)
+            self.refresher.start()
+        return self.refresher
 
-            document.getElementById('status').innerHTML = 
-                count + ' Access Points angezeigt<br>' +
-                crackedCount + ' davon geknackt';
+    def request_refresh(self):
+        """
+        Signalisiert eine Änderung: mit Hintergrund-Aktualisierung wird sofort
+        neu gescannt (ohne auf das Ergebnis zu warten), sonst beim nächsten Zugriff.
+        Gibt zurück, ob im Hintergrund aktualisiert wird.
+        """
+        if self.refresher is None:
+            return False
+        self.refresher.trigger()
+        return True
 
-            // Fit map to show all markers
-            if (markers.length > 0) {
-                var group = new L.featureGroup(markers);
-                map.fitBounds(group.getBounds().pad(0.1));
-            } else {
-                // If no markers, reset view to default or last known good view
-                map.setView([48.2685195, 10.0766273], 13);
-            }
-        }
+    def start_watcher(self, poll_interval=5.0):
+        """
+        Startet je Gerät einen Dateisystem-Watcher; Deltas werden über self.events verteilt.
+        """
+        self._poll_interval = poll_interval
+        for device in self.devices.values():
+            self._start_device_watcher(device, poll_interval)
+        return self.watchers
 
-        // Load positions on page load
-        loadPositions();
-    </script>
-</body>
-</html>"""
+    def _start_device_watcher(self, device, poll_interval):
+        def on_change(filenames):
+            delta = self.apply_changes(filenames, device)
+            if delta["upsert"] or delta["remove"]:
+                logging.info(
+                    f"[webgpsmap] Live-Update ({device.label}): {len(delta['upsert'])} neu/geändert, {len(delta['remove'])} entfernt"
+                )
+                self.events.publish("update", delta)
+
+        watcher = DirectoryWatcher(
+            device.directory,
+            on_change,
+            poll_interval=poll_interval,
+            recursive=self.scanner.recursive,
         )
-        return html_template
+        watcher.start()
+        self.watchers[device.label] = watcher
+        return watcher
+
+    def configure_map(self, tiles=None, leaflet_dir=None):
+        """
+        Lässt die Karte Kacheln (TileStore unter /tiles) und Leaflet (Verzeichnis
+        mit leaflet.js/leaflet.css unter /leaflet) vom eigenen Server laden statt
+        von tile.openstreetmap.org und unpkg.com.
+        """
+        if tiles is not None:
+            self.tile_url = self.LOCAL_TILE_URL
+            self.tile_attribution = tiles.attribution or self.OSM_ATTRIBUTION
+            self.tile_max_zoom = tiles.max_zoom or self.tile_max_zoom
+        if leaflet_dir is not None:
+            for filename in ("leaflet.js", "leaflet.css"):
+                if not os.path.isfile(os.path.join(leaflet_dir, filename)):
+                    raise ValueError(f"{filename} fehlt in {leaflet_dir}")
+            self.leaflet_dir = leaflet_dir
+        self._page = None
+
+    def _leaflet_tags(self, inline=False):
+        """
+        Gibt (stylesheet, script) für Leaflet zurück: CDN, lokale Route oder, für
+        die Offline-Karte, direkt eingebettet.
+        """
+        if self.leaflet_dir is None:
+            return (
+                f'<link rel="stylesheet" href="{self.LEAFLET_CDN}/leaflet.css" />',
+                f'<script src="{self.LEAFLET_CDN}/leaflet.js"></script>',
+            )
+        if not inline:
+            return (
+                '<link rel="stylesheet" href="/leaflet/leaflet.css" />',
+                '<script src="/leaflet/leaflet.js"></script>',
+            )
+        with open(os.path.join(self.leaflet_dir, "leaflet.css"), "r", encoding="utf-8") as f:
+            css = f.read()
+        with open(os.path.join(self.leaflet_dir, "leaflet.js"), "r", encoding="utf-8") as f:
+            js = f.read().replace("</script", "<\\/script")
+        return f"<style>\n{css}\n</style>", f"<script>\n{js}\n</script>"
+
+    def map_config(self, base_url=None):
+        """
+        Werte dieser Instanz für die Karte (/config bzw. in der Offline-Karte eingebettet).
+        Mit base_url zeigen lokale Kacheln absolut auf diesen Server.
+        """
+        tile_url = self.tile_url
+        if base_url is not None and tile_url.startswith("/"):
+            tile_url = base_url.rstrip("/") + tile_url
+        return {
+            "devices": [
+                {"label": device.label, "directory": device.directory} for device in self.devices.values()
+            ],
+            "tiles": {"url": tile_url, "attribution": self.tile_attribution, "max_zoom": int(self.tile_max_zoom)},
+            # Die Heatmap-Kacheln rechnet der Server, in der Offline-Karte gibt es sie nicht
+            "heatmap": base_url is None and load_numpy() is not None,
+            "heatmap_max_zoom": HeatmapIndex.MAX_ZOOM,
+        }
+
+    def get_page(self):
+        """
+        Statische Teile der Karte (MapPage), einmal gebaut; configure_map() verwirft sie.
+        """
+        page = self._page
+        if page is None:
+            page = self._page = MapPage(*self._leaflet_tags())
+        return page
+
+    def get_html(self, base_url=None):
+        """
+        Returns the html page with embedded map and filter options.
+        Eigenständig mit eingebettetem CSS/JS und Werten der Instanz, für die
+        Offline-Karte; der Server liefert stattdessen get_page() aus.
+        Mit base_url zeigen lokale Kacheln absolut auf diesen Server.
+        """
+        leaflet_css, leaflet_js = self._leaflet_tags(inline=True)
+        return MapPage.inline(leaflet_css, leaflet_js, self.map_config(base_url))
+
+
+ISO_FRACTION = re.compile(r"\.(\d+)")
+DATE_ONLY = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def parse_timestamp(value):
+    """
+    Normalisiert einen Zeitstempel (Unix-Sekunden als Zahl oder Text, ISO-8601 oder
+    ein anderes von dateutil lesbares Format) auf ganze Unix-Sekunden.
+    ISO-8601 geht über datetime.fromisoformat, dateutil wird nur für den Rest geladen.
+    Wirft ValueError bei ungültigen Werten.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if not math.isfinite(value):
+            raise ValueError(f"Ungültiger Zeitstempel: {value}")
+        return int("%.0f" % value)
+    if not isinstance(value, str):
+        raise ValueError(f"Ungültiger Zeitstempel: {value!r}")
+    text = value.strip()
+    try:
+        return parse_timestamp(float(text))
+    except ValueError:
+        pass
+    # fromisoformat kennt (vor Python 3.11) weder "Z" noch andere als 3 oder 6 Nachkommastellen
+    iso = ISO_FRACTION.sub(lambda match: "." + match.group(1)[:6].ljust(6, "0"), text, count=1)
+    if iso.endswith(("Z", "z")):
+        iso = iso[:-1] + "+00:00"
+    try:
+        date = datetime.datetime.fromisoformat(iso)
+    except ValueError:
+        try:
+            from dateutil.parser import parse
+        except ImportError:
+            raise ValueError(f"Zeitstempel ist kein ISO-8601 (dateutil nicht installiert): {value}")
+        try:
+            date = parse(text)
+        except OverflowError:
+            raise ValueError(f"Ungültiger Zeitstempel: {value}")
+    return int("%.0f" % date.timestamp())
 
 
 class PositionFile:
@@ -454,6 +4043,7 @@ class PositionFile:
             logging.debug(f"[webgpsmap] loading {path}")
             with open(path, "r") as json_file:
                 self._json = json.load(json_file)
+                self._stat = os.fstat(json_file.fileno())
             logging.debug(f"[webgpsmap] loaded {path}")
         except json.JSONDecodeError as js_e:
             raise js_e
@@ -492,7 +4082,7 @@ class PositionFile:
         returns the timestamp of AP first seen
         """
         # use file timestamp creation time of the pcap file
-        return int("%.0f" % os.path.getctime(self._file))
+        return int("%.0f" % self._stat.st_ctime)
 
     def timestamp_last(self):
         """
@@ -500,14 +4090,13 @@ class PositionFile:
         """
         return_ts = None
         if "ts" in self._json:
-            return_ts = self._json["ts"]
+            return_ts = parse_timestamp(self._json["ts"])
         elif "Updated" in self._json:
             # convert gps datetime to unix timestamp: "2019-10-05T23:12:40.422996+01:00"
-            dateObj = parse(self._json["Updated"])
-            return_ts = int("%.0f" % dateObj.timestamp())
+            return_ts = parse_timestamp(self._json["Updated"])
         else:
             # use file timestamp last modification of the json file
-            return_ts = int("%.0f" % os.path.getmtime(self._file))
+            return_ts = int("%.0f" % self._stat.st_mtime)
         return return_ts
 
     def password(self):
@@ -608,6 +4197,143 @@ class PositionFile:
         return None
 
 
+def parse_position_file(path):
+    """
+    Parst eine Positionsdatei und gibt die für die Karte benötigten Felder als
+    PositionRecord zurück; das geparste JSON wird danach nicht weiter gehalten.
+    Wirft JSONDecodeError, ValueError oder OSError bei defekten Dateien.
+    """
+    pos = PositionFile(path)
+    if (
+        not pos.type() == PositionFile.GPS
+        and not pos.type() == PositionFile.GEO
+        and not pos.type() == PositionFile.PAWGPS
+    ):
+        return None
+
+    ssid, mac = pos.ssid(), pos.mac()
+    ssid = "unknown" if not ssid else ssid
+    if not mac:
+        raise ValueError("Mac can't be parsed from filename")
+
+    return PositionRecord(
+        ssid=ssid,
+        mac=mac,
+        type=pos.type(),
+        lat=pos.lat(),
+        lng=pos.lng(),
+        acc=pos.accuracy(),
+        ts_first=pos.timestamp_first(),
+        ts_last=pos.timestamp_last(),
+    )
+
+
+def _parse_position_file_safe(path):
+    """
+    Wie parse_position_file, gibt aber (record, error) zurück (für Worker-Pools).
+    """
+    try:
+        return parse_position_file(path), None
+    except (json.JSONDecodeError, ValueError, OSError) as error:
+        return None, error
+
+
+EXPORT_FORMATS = ("geojson", "ndjson", "csv")
+EXPORT_FIELDS = (
+    "ssid",
+    "mac",
+    "type",
+    "lat",
+    "lng",
+    "acc",
+    "ts_first",
+    "ts_last",
+    "pass",
+    "pass_source",
+    "sources",
+    "devices",
+    "sightings",
+    "spread",
+)
+
+
+def export_positions(positions, out, fmt):
+    """
+    Schreibt AP-Einträge (z. B. aus iter_positions) als GeoJSON, NDJSON oder CSV
+    in die Textdatei out, jeden sofort. Gibt die Anzahl der Einträge zurück.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unbekanntes Exportformat: {fmt} (erlaubt: {', '.join(EXPORT_FORMATS)})")
+    count = 0
+    if fmt == "ndjson":
+        for ap_data in positions:
+            out.write(json.dumps(ap_data, ensure_ascii=False) + "\n")
+            count += 1
+    elif fmt == "geojson":
+        out.write('{"type": "FeatureCollection", "features": [\n')
+        for ap_data in positions:
+            properties = {key: value for key, value in ap_data.items() if key not in ("lat", "lng")}
+            geometry = None
+            if ap_data.get("lat") is not None and ap_data.get("lng") is not None:
+                geometry = {"type": "Point", "coordinates": [ap_data["lng"], ap_data["lat"]]}
+            feature = {"type": "Feature", "geometry": geometry, "properties": properties}
+            out.write((",\n" if count else "") + json.dumps(feature, ensure_ascii=False))
+            count += 1
+        out.write("\n]}\n")
+    else:
+        writer = csv.writer(out, lineterminator="\n")
+        writer.writerow(EXPORT_FIELDS)
+        for ap_data in positions:
+            # Listen (sources, devices) mit ";" getrennt in einer Spalte
+            writer.writerow(
+                [
+                    ";".join(value) if isinstance(value, list) else ("" if value is None else value)
+                    for value in (ap_data.get(field) for field in EXPORT_FIELDS)
+                ]
+            )
+            count += 1
+    return count
+
+
+def run_export(webgps, fmt, output="-"):
+    """
+    Headless-Export für --export: ohne Flask und Watcher, Meldungen nur im Log
+    (stderr), damit stdout sauber bleibt. Eine Datei wird erst am Ende ersetzt.
+    """
+    if output == "-":
+        try:
+            count = export_positions(webgps.iter_positions(), sys.stdout, fmt)
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # z. B. "| head": Leser ist fertig, kein Fehler
+            sys.stdout = open(os.devnull, "w")
+            return 0
+    else:
+        tmp_path = output + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8", newline="") as out:
+            count = export_positions(webgps.iter_positions(), out, fmt)
+        os.replace(tmp_path, output)
+    logging.info(f"[webgpsmap] {count} Positionen als {fmt} exportiert ({output})")
+    return count
+
+
+def print_quarantine(webgps, out=None):
+    """
+    Bericht für --quarantine: scannt einmal und listet die defekten Positionsdateien
+    mit Grund auf. Gibt deren Anzahl zurück.
+    """
+    out = out or sys.stdout
+    webgps.load_gps_from_dir()
+    report = webgps.quarantine.report()
+    if not report:
+        print("✅ Keine defekten Positionsdateien", file=out)
+        return 0
+    print(f"⚠️  {len(report)} defekte Positionsdateien:", file=out)
+    for entry in report:
+        print(f"{entry['reason']:<6} {entry['path']} - {entry['error']}", file=out)
+    return len(report)
+
+
 def load_config():
     """Lädt die Konfiguration aus config.json oder erstellt eine neue"""
     config_file = "webgpsmap_config.json"
@@ -616,6 +4342,22 @@ def load_config():
         "host": "127.0.0.1",
         "port": 5000,
         "debug": False,
+        "index_file": "webgpsmap_index.db",
+        "watch": True,
+        "poll_interval": 5.0,
+        "position_cache_size": 100000,
+        "scan_workers": 1,
+        "scan_pool": "thread",
+        "recursive": False,
+        "devices": {},
+        "tiles": None,
+        "tile_cache_size": 512,
+        "leaflet_dir": None,
+        "slow_request_ms": None,
+        "server": "production",
+        "server_threads": 16,
+        "refresh_interval": 60.0,
+        "quarantine_size": 10000,
     }
 
     if os.path.exists(config_file):
@@ -647,21 +4389,357 @@ def save_config(config):
         logging.error(f"Fehler beim Speichern der Konfiguration: {e}")
 
 
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True  # offene Live-Update-Verbindungen halten das Beenden nicht auf
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logging.debug(f"[webgpsmap] {self.address_string()} {format % args}")
+
+
+def serve_production(app, host, port, threads=16):
+    """
+    Produktiver Betrieb ohne den Entwicklungsserver von Flask: waitress, wenn
+    installiert, sonst wsgiref aus der Standardbibliothek mit einem Thread pro
+    Verbindung. Bei waitress belegt jeder offene /events-Client einen der threads.
+    """
+    try:
+        import waitress  # optional, sonst wsgiref mit Threads
+    except ImportError:
+        waitress = None
+    if waitress is not None:
+        logging.info(f"[webgpsmap] Server: waitress mit {threads} Threads")
+        waitress.serve(app, host=host, port=port, threads=threads)
+        return
+    logging.info("[webgpsmap] Server: wsgiref (ein Thread pro Verbindung)")
+    server = make_server(
+        host, port, app, server_class=ThreadingWSGIServer, handler_class=QuietWSGIRequestHandler
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def create_app(webgps, tiles=None, slow_request_ms=None):
+    """
+    Erstellt die Flask-App für eine WebGPSMapStandalone-Instanz (und optional einen
+    TileStore für /tiles). Getrennt von main(), damit sie sich z. B. mit dem
+    Test-Client von Flask ohne Server verwenden lässt. Anfragen über slow_request_ms
+    werden mit der Aufschlüsselung nach Stufen geloggt. Antworten aus dem Bestand
+    tragen Alter und Generation des verwendeten Snapshots (X-Snapshot-Age/-Generation).
+    """
+    from flask import Flask, Response, g, request, jsonify, send_from_directory
+
+    # Flask App erstellen
+    # Kein Flask-Static-Ordner: /static liefert MapPage aus
+    app = Flask(__name__, static_folder=None)
+    metrics = webgps.metrics
+
+    if tiles is not None:
+        metrics.gauge("tile_cache_hits_total", "Treffer im Kachel-Cache", lambda: tiles.hits, kind="counter")
+        metrics.gauge("tile_cache_misses_total", "Fehltreffer im Kachel-Cache", lambda: tiles.misses, kind="counter")
+
+    def request_snapshot():
+        snapshot = g.snapshot = webgps.snapshot()
+        return snapshot
+
+    def tile_response(tile, mimetype, cache_control):
+        data, etag = tile
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(data, mimetype=mimetype)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = cache_control
+        return response
+
+    @app.before_request
+    def start_request_trace():
+        metrics.start_trace()
+
+    @app.after_request
+    def record_request(response):
+        snapshot = g.pop("snapshot", None)
+        if snapshot is not None:
+            response.headers["X-Snapshot-Age"] = f"{snapshot.age():.1f}"
+            response.headers["X-Snapshot-Generation"] = str(snapshot.generation)
+        elapsed, stages = metrics.stop_trace()
+        endpoint = request.endpoint or "unknown"
+        metrics.observe("http_request_duration_seconds", elapsed, endpoint=endpoint)
+        metrics.inc("http_requests_total", endpoint=endpoint, status=str(response.status_code))
+        if slow_request_ms is not None and elapsed * 1000 >= slow_request_ms:
+            breakdown = ", ".join(f"{stage}={duration * 1000:.1f}ms" for stage, duration in stages)
+            logging.warning(
+                f"[webgpsmap] Langsame Anfrage {request.method} {request.full_path.rstrip('?')}: "
+                f"{elapsed * 1000:.1f}ms ({breakdown or 'keine Stufen'})"
+            )
+        return response
+
+    @app.route("/metrics")
+    def get_metrics():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/")
+    def index():
+        # Gerüst per ETag, CSS/JS über Hash-URLs aus dem Browser-Cache
+        return cached_response(webgps.get_page().html)
+
+    @app.route("/static/<filename>")
+    def get_static_asset(filename):
+        asset = webgps.get_page().assets.get(filename)
+        if asset is None:
+            return Response(status=404)
+        return cached_response(asset, MapPage.CACHE_CONTROL)
+
+    @app.route("/config")
+    def get_map_config():
+        response = jsonify(webgps.map_config())
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    @app.route("/all")
+    def get_all_positions():
+        try:
+            params = FilterIndex.parse_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        snapshot = request_snapshot()
+        if FilterIndex.is_filtered(params):
+            keys = webgps.get_filter_index(snapshot).match(params)
+            data = {key: ap_data for key, ap_data in snapshot.positions.items() if key in keys}
+            return jsonify(data)
+        return cached_response(webgps.get_serialized_positions(snapshot).json)
+
+    @app.route("/stream")
+    def stream_positions():
+        # Wie /all, aber als NDJSON in Stücken; das ETag ist der Cursor des Snapshots
+        snapshot = request_snapshot()
+        stream = PositionStream(snapshot.positions, webgps.changelog.cursor(snapshot.generation))
+        return streamed_response(stream, PositionStream.MIMETYPE, flush=True)
+
+    @app.route("/tiles/<int:z>/<int:x>/<int:y>.png")
+    def get_tile(z, x, y):
+        if tiles is None:
+            return jsonify({"error": "Keine lokalen Kacheln konfiguriert"}), 404
+        tile = tiles.get(z, x, y)
+        if tile is None:
+            return Response(status=404)
+        return tile_response(tile, tiles.mimetype, "public, max-age=86400")
+
+    @app.route("/heatmap/<int:z>/<int:x>/<int:y>.png")
+    def get_heatmap_tile(z, x, y):
+        if load_numpy() is None:
+            return jsonify({"error": "Heatmap benötigt NumPy (pip3 install numpy)"}), 501
+        heatmap = webgps.get_heatmap_index(request_snapshot())
+        try:
+            tile = heatmap.tile(z, x, y, request.args.get("channel", "all"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if tile is None:
+            return Response(status=404)
+        # Ändert sich mit dem Bestand: immer per ETag nachfragen lassen
+        return tile_response(tile, "image/png", "no-cache")
+
+    @app.route("/leaflet/<path:filename>")
+    def get_leaflet_asset(filename):
+        if webgps.leaflet_dir is None:
+            return jsonify({"error": "Kein lokales Leaflet konfiguriert"}), 404
+        return send_from_directory(os.path.abspath(webgps.leaflet_dir), filename, max_age=86400)
+
+    @app.route("/devices")
+    def get_devices():
+        request_snapshot()
+        return jsonify(
+            [
+                {
+                    "label": device.label,
+                    "directory": device.directory,
+                    "positions": len(device.positions),
+                    "watching": device.label in webgps.watchers,
+                }
+                for device in webgps.devices.values()
+            ]
+        )
+
+    @app.route("/search")
+    def search_positions():
+        try:
+            params = FilterIndex.parse_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(webgps.get_filter_index(request_snapshot()).search(params))
+
+    @app.route("/positions")
+    def get_positions():
+        try:
+            params = FilterIndex.parse_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        bbox = request.args.get("bbox")
+        if bbox:
+            try:
+                bbox = tuple(float(value) for value in bbox.split(","))
+                if len(bbox) != 4 or not all(math.isfinite(value) for value in bbox):
+                    raise ValueError
+            except ValueError:
+                return jsonify({"error": "bbox muss west,south,east,north sein"}), 400
+        try:
+            zoom = float(request.args.get("zoom", "0"))
+            if not math.isfinite(zoom):
+                raise ValueError
+        except ValueError:
+            return jsonify({"error": "zoom muss eine Zahl sein"}), 400
+        snapshot = request_snapshot()
+        spatial_index = webgps.get_spatial_index(snapshot)
+        filter_index = webgps.get_filter_index(snapshot)
+        keys = None
+        if FilterIndex.is_filtered(params):
+            keys = filter_index.match(params)
+        result = spatial_index.query(bbox or None, zoom, keys)
+        # Für den Zeitregler der Karte: Zeitspanne des gesamten Bestands
+        result["time_bounds"] = filter_index.time_bounds(params["time"])
+        return jsonify(result)
+
+    @app.route("/refresh", methods=["POST"])
+    def refresh_positions():
+        # Änderungssignal, z. B. nach dem Synchronisieren eines Geräts
+        if webgps.request_refresh():
+            return jsonify({"refreshing": True, "generation": webgps.generation}), 202
+        webgps.load_gps_from_dir()
+        return jsonify({"refreshing": False, "generation": webgps.generation})
+
+    @app.route("/changes")
+    def get_changes():
+        try:
+            return jsonify(webgps.changes_since(request.args.get("since"), request_snapshot()))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route("/quarantine")
+    def get_quarantine():
+        request_snapshot()
+        report = webgps.quarantine.report()
+        reasons = dict.fromkeys(Quarantine.REASONS, 0)
+        for entry in report:
+            reasons[entry["reason"]] += 1
+        return jsonify({"count": len(report), "reasons": reasons, "files": report})
+
+    @app.route("/events")
+    def events():
+        return Response(
+            webgps.events.stream(),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.route("/offlinemap")
+    def get_offline_map():
+        response = streamed_response(
+            webgps.get_serialized_positions(request_snapshot()).offline(webgps, request.host_url)
+        )
+        response.headers["Content-Disposition"] = "attachment; filename=webgpsmap.html"
+        return response
+
+    return app
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="WebGPSMap Standalone - Zeigt Access Points auf einer Karte an"
     )
     parser.add_argument("--dir", "-d", help="Handshakes-Verzeichnis")
+    parser.add_argument(
+        "--device",
+        action="append",
+        metavar="LABEL=VERZEICHNIS",
+        help="Handshakes-Verzeichnis eines Geräts, mehrfach angebbar (ersetzt --dir)",
+    )
     parser.add_argument(
         "--host", default="127.0.0.1", help="Host-Adresse (Standard: 127.0.0.1)"
     )
     parser.add_argument(
         "--port", "-p", type=int, default=5000, help="Port (Standard: 5000)"
     )
-    parser.add_argument("--debug", action="store_true", help="Debug-Modus aktivieren")
+    parser.add_argument("--debug", action="store_true", help="Debug-Modus aktivieren (Flask-Entwicklungsserver)")
+    parser.add_argument(
+        "--server",
+        choices=["production", "flask"],
+        help="production: waitress bzw. wsgiref mit Threads, flask: Entwicklungsserver (Standard: production)",
+    )
     parser.add_argument(
         "--config", action="store_true", help="Konfiguration interaktiv ändern"
     )
+    parser.add_argument(
+        "--no-watch",
+        action="store_true",
+        help="Handshakes-Verzeichnis nicht auf Änderungen überwachen (keine Live-Updates)",
+    )
+    parser.add_argument(
+        "--recursive",
+        "-r",
+        action="store_true",
+        help="Unterverzeichnisse (z. B. pro Tag oder Gerät) mit durchsuchen",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Worker für das Parsen beim Kaltstart (Standard: 1 = sequentiell)",
+    )
+    parser.add_argument(
+        "--pool",
+        choices=["thread", "process"],
+        help="Art des Worker-Pools für --workers (Standard: thread)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        help="Maximale Anzahl Positionsdateien im Speicher-Cache (Standard: 100000)",
+    )
+    parser.add_argument(
+        "--index",
+        help="Pfad zur SQLite-Indexdatei (Standard: webgpsmap_index.db, leer = nur im Speicher)",
+    )
+    parser.add_argument(
+        "--tiles",
+        help="Kacheln lokal ausliefern: MBTiles-Datei oder Verzeichnis mit {z}/{x}/{y}.png",
+    )
+    parser.add_argument(
+        "--leaflet-dir",
+        help="Verzeichnis mit leaflet.js und leaflet.css, statt unpkg.com",
+    )
+    parser.add_argument(
+        "--slow-request-ms",
+        type=float,
+        help="Anfragen ab so vielen Millisekunden mit Aufschlüsselung nach Stufen loggen",
+    )
+    parser.add_argument(
+        "--refresh-interval",
+        type=float,
+        help="Bestand alle so vielen Sekunden im Hintergrund neu aufbauen, 0 = bei jeder Anfrage (Standard: 60)",
+    )
+    parser.add_argument(
+        "--export",
+        choices=EXPORT_FORMATS,
+        help="Positionen ohne Webserver als GeoJSON, NDJSON oder CSV exportieren und beenden",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        default="-",
+        help="Zieldatei für --export (Standard: - = stdout)",
+    )
+    parser.add_argument(
+        "--quarantine",
+        action="store_true",
+        help="Defekte Positionsdateien mit Grund auflisten und beenden",
+    )
+    parser.add_argument(
+        "--export-offline",
+        metavar="DATEI",
+        help="Offline-Karte in DATEI schreiben und beenden (ohne Webserver)",
+    )
 
     args = parser.parse_args()
 
@@ -703,11 +4781,76 @@ def main():
     if args.debug:
         config["debug"] = True
         logging.getLogger().setLevel(logging.DEBUG)
+    if args.index is not None:
+        config["index_file"] = args.index
+    if args.no_watch:
+        config["watch"] = False
+    if args.recursive:
+        config["recursive"] = True
+    if args.workers is not None:
+        config["scan_workers"] = args.workers
+    if args.pool is not None:
+        config["scan_pool"] = args.pool
+    if args.cache_size is not None:
+        config["position_cache_size"] = args.cache_size
+    if args.tiles is not None:
+        config["tiles"] = args.tiles
+    if args.slow_request_ms is not None:
+        config["slow_request_ms"] = args.slow_request_ms
+    if args.server is not None:
+        config["server"] = args.server
+    if args.leaflet_dir is not None:
+        config["leaflet_dir"] = args.leaflet_dir
+    if args.refresh_interval is not None:
+        if args.refresh_interval < 0:
+            parser.error("--refresh-interval darf nicht negativ sein")
+        config["refresh_interval"] = args.refresh_interval
+
+    devices = dict(config.get("devices") or {})
+    for spec in args.device or []:
+        label, sep, directory = spec.partition("=")
+        if not sep or not label or not directory:
+            parser.error(f"--device erwartet LABEL=VERZEICHNIS: {spec}")
+        devices[label] = directory
+
+    options = dict(
+        index_file=config.get("index_file", "webgpsmap_index.db"),
+        position_cache_size=config.get("position_cache_size", 100000),
+        scan_workers=config.get("scan_workers", 1),
+        scan_pool=config.get("scan_pool", "thread"),
+        recursive=config.get("recursive", False),
+        devices=devices or None,
+        quarantine_size=config.get("quarantine_size", 10000),
+    )
+
+    if args.export:
+        # Ohne Rückfragen und Ausgaben auf stdout, das gehört dem Export
+        try:
+            webgps = WebGPSMapStandalone(None if devices else config["handshakes_dir"], **options)
+            run_export(webgps, args.export, args.output)
+        except (ValueError, OSError, sqlite3.Error) as e:
+            logging.error(f"[webgpsmap] Export fehlgeschlagen: {e}")
+            sys.exit(1)
+        return
+
+    if args.quarantine:
+        try:
+            webgps = WebGPSMapStandalone(None if devices else config["handshakes_dir"], **options)
+            print_quarantine(webgps)
+        except (ValueError, OSError, sqlite3.Error) as e:
+            print(f"❌ Fehler: {e}")
+            sys.exit(1)
+        return
 
     # Verzeichnis prüfen/abfragen
     handshakes_dir = config["handshakes_dir"]
 
-    if not os.path.exists(handshakes_dir):
+    if devices:
+        # Geräte konfiguriert: handshakes_dir wird nicht verwendet
+        handshakes_dir = None
+        for label, directory in devices.items():
+            print(f"\n🗂️  Handshakes-Verzeichnis ({label}): {directory}")
+    elif not os.path.exists(handshakes_dir):
         print(f"\n❌ Handshakes-Verzeichnis existiert nicht: {handshakes_dir}")
         print("\nBitte gib ein gültiges Verzeichnis an:")
         while True:
@@ -720,43 +4863,41 @@ def main():
             else:
                 print(f"❌ Verzeichnis existiert nicht: {new_dir}")
 
-    print(f"\n🗂️  Handshakes-Verzeichnis: {handshakes_dir}")
+    if handshakes_dir is not None:
+        print(f"\n🗂️  Handshakes-Verzeichnis: {handshakes_dir}")
 
     # Erstelle WebGPSMap Instanz
     try:
-        webgps = WebGPSMapStandalone(handshakes_dir)
+        webgps = WebGPSMapStandalone(handshakes_dir, **options)
+        tiles = None
+        if config.get("tiles"):
+            tiles = TileStore(config["tiles"], cache_size=config.get("tile_cache_size", 512))
+            print(f"🗺️  Lokale Kacheln: {config['tiles']}")
+        webgps.configure_map(tiles=tiles, leaflet_dir=config.get("leaflet_dir") or None)
     except ValueError as e:
         print(f"❌ Fehler: {e}")
         sys.exit(1)
+    except sqlite3.Error as e:
+        print(f"❌ Fehler beim Öffnen des Positions-Index: {e}")
+        sys.exit(1)
 
-    # Flask App erstellen
-    app = Flask(__name__)
+    # Index beim Start abgleichen, damit die erste Anfrage nicht alles parsen muss
+    print("🔎 Synchronisiere Positions-Index...")
+    positions = webgps.load_gps_from_dir()
 
-    @app.route("/")
-    def index():
-        webgps.ALREADY_SENT = list()  # Reset for fresh load
-        return Response(webgps.get_html(), mimetype="text/html")
+    if args.export_offline:
+        base_url = f"http://{config['host']}:{config['port']}/"
+        OfflineMap(webgps.get_html(base_url), positions).write(args.export_offline)
+        print(f"📥 Offline-Karte geschrieben: {args.export_offline} ({len(positions)} APs)")
+        return
 
-    @app.route("/all")
-    def get_all_positions():
-        webgps.ALREADY_SENT = list()  # Reset for fresh load
-        data = webgps.load_gps_from_dir()
-        return jsonify(data)
+    if config.get("watch", True):
+        webgps.start_watcher(poll_interval=config.get("poll_interval", 5.0))
+    if config.get("refresh_interval"):
+        # Anfragen werden danach immer sofort aus dem letzten Snapshot beantwortet
+        webgps.start_refresher(config["refresh_interval"])
 
-    @app.route("/offlinemap")
-    def get_offline_map():
-        webgps.ALREADY_SENT = list()  # Reset for fresh load
-        json_data = json.dumps(webgps.load_gps_from_dir())
-        html_data = webgps.get_html()
-        html_data = html_data.replace(
-            "var allPositions = [];",
-            "var allPositions = Object.values("
-            + json_data
-            + ");positionsLoaded=true;applyFilters();",
-        )
-        response = Response(html_data, mimetype="text/html")
-        response.headers["Content-Disposition"] = "attachment; filename=webgpsmap.html"
-        return response
+    app = create_app(webgps, tiles, slow_request_ms=config.get("slow_request_ms"))
 
     # Server starten
     print(f"\n🚀 Starte WebGPSMap Server...")
@@ -766,7 +4907,17 @@ def main():
     print(f"\n🛑 Server stoppen: Strg+C")
 
     try:
-        app.run(host=config["host"], port=config["port"], debug=config["debug"])
+        if config.get("server", "production") == "production" and not config["debug"]:
+            serve_production(app, config["host"], config["port"], threads=config.get("server_threads", 16))
+        else:
+            # Kein Reloader: er würde den Watcher-Thread doppelt starten
+            app.run(
+                host=config["host"],
+                port=config["port"],
+                debug=config["debug"],
+                threaded=True,
+                use_reloader=False,
+            )
     except KeyboardInterrupt:
         print("\n\n👋 Server gestoppt!")
     except Exception as e: